@@ -0,0 +1,71 @@
+import threading
+import time
+
+import connect
+
+# Через сколько секунд подтверждённое состояние пина считается устаревшим:
+# следующая же команда с тем же значением уйдёт на хаб повторно (ловим сброс ведомого)
+RESYNC_SEC = 300
+
+
+class _PinState:
+    __slots__ = ("desired", "confirmed", "confirmed_at", "in_flight")
+
+    def __init__(self):
+        self.desired = None      # последнее запрошенное значение
+        self.confirmed = None    # значение, на которое ведомый ответил ACK (None — неизвестно)
+        self.confirmed_at = 0.0
+        self.in_flight = None    # значение команды, которая сейчас в очереди к хабу
+
+
+_pins: dict[tuple[int, int], _PinState] = {}
+_lock = threading.Lock()
+
+
+def set_value(channel: int, pin: int, value: int, force: bool = False) -> bool:
+    """Ставит пин актора в value, не дожидаясь ответа хаба.
+
+    Команда уходит, только если value отличается от подтверждённого состояния,
+    оно устарело (RESYNC_SEC) или force. Пока к пину идёт команда, новые
+    значения не ставятся в очередь: после ответа отправится только последнее.
+    Возвращает False, если отправка не понадобилась.
+    """
+    key = (channel, pin)
+    with _lock:
+        state = _pins.get(key)
+        if state is None:
+            state = _pins[key] = _PinState()
+        state.desired = value
+        if state.in_flight is not None:
+            return True
+        if (not force and state.confirmed == value
+                and time.monotonic() - state.confirmed_at < RESYNC_SEC):
+            return False
+        state.in_flight = value
+    _send(key, value)
+    return True
+
+
+def _send(key: tuple[int, int], value: int) -> None:
+    connect.act_async(key[0], key[1], value).add_done_callback(
+        lambda future: _done(key, value, future))
+
+
+def _done(key: tuple[int, int], value: int, future) -> None:
+    try:
+        reply = future.result()
+    except Exception as e:
+        reply = f"ERROR: {e}"
+    print(reply)
+    with _lock:
+        state = _pins[key]
+        state.in_flight = None
+        if reply == "OK":
+            state.confirmed, state.confirmed_at = value, time.monotonic()
+        else:
+            # состояние неизвестно — повторим при следующей команде
+            state.confirmed = None
+        if state.desired == value:
+            return
+        value = state.in_flight = state.desired
+    _send(key, value)
@@ -0,0 +1,322 @@
+"""Бенчмарки конвейера опрос → хранение → сценарии → график.
+
+    python benchmark.py -o bench.json
+    python benchmark.py --rows 1000000 --compare bench.json
+
+Хаб подменяется simulator.VirtualHub, базы создаются во временном каталоге.
+Результат — JSON, чтобы сравнивать прогоны между собой.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import connect
+import database
+import simulator
+
+BENCHMARKS = {}
+
+# Модули, которые при старте бота грузиться не должны — только при первом использовании.
+# requests и aiohttp сюда не входят: их импортирует сам telebot (async_telebot)
+HEAVY_MODULES = ("matplotlib", "PIL", "numpy")
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def _timings(fn, repeat: int) -> dict:
+    """Время вызова fn в миллисекундах: min / median / max."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "repeat": repeat,
+    }
+
+
+def _add_sensors(count: int, db_path: str = "smart_home.db") -> list[tuple[int, int]]:
+    """Регистрирует count датчиков по 8 на канал, возвращает их (channel, pin)."""
+    pairs = [(1 + i // 8, 14 + i % 8) for i in range(count)]
+    for channel, pin in pairs:
+        database.add_sensor({
+            "name": f"bench-{channel}-{pin}", "description": "",
+            "channel": channel, "pin": pin, "interval_sec": 10,
+        }, db_path)
+    return pairs
+
+
+def _seed_readings(db_path: str, rows: int, sensors: int, span_sec: int) -> None:
+    """Быстро заливает rows показаний, равномерно за последние span_sec секунд."""
+    with contextlib.closing(database.get_connection(db_path)) as conn:
+        conn.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO sensors_data (sensor_id, ts, value)
+            SELECT 1 + i % ?,
+                   CAST(strftime('%s', 'now') AS INTEGER) - (? - i) * ? / ?,
+                   i % 1024
+              FROM n
+        ''', (rows, sensors, rows, span_sec, rows))
+        conn.commit()
+    database.rebuild_rollups(db_path)
+
+
+@benchmark
+def get_data_throughput(args) -> dict:
+    """Показаний в секунду через database.get_data и пакетный get_data_many."""
+    pairs = _add_sensors(args.sensors)
+    start = time.perf_counter()
+    for channel, pin in pairs:
+        database.get_data(channel, pin)
+    database.flush_data()
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    database.get_data_many(pairs)
+    database.flush_data()
+    batched = time.perf_counter() - start
+    return {
+        "readings": len(pairs),
+        "readings_per_sec": round(len(pairs) / single, 1),
+        "batched_readings_per_sec": round(len(pairs) / batched, 1),
+    }
+
+
+@benchmark
+def add_data_throughput(args) -> dict:
+    """Вставок в секунду через database.add_data."""
+    channel, pin = _add_sensors(1)[0]
+    start = time.perf_counter()
+    for i in range(args.inserts):
+        database.add_data(channel, pin, float(i))
+    database.flush_data()
+    elapsed = time.perf_counter() - start
+    return {"inserts": args.inserts, "inserts_per_sec": round(args.inserts / elapsed, 1)}
+
+
+@benchmark
+def recent_readings(args) -> dict:
+    """Последнее значение и короткое окно по свежим показаниям (кольцевой буфер)."""
+    _add_sensors(1)
+    sensor_id = database.list_sensors()[-1]["id"]
+    for i in range(600):
+        database.add_data_by_id(sensor_id, float(i))
+    database.flush_data()
+    return {
+        "window_10_min": _timings(lambda: database.get_sensor_data(sensor_id, 10), args.repeat),
+        "last_reading": _timings(lambda: database.get_last_sensor_reading(sensor_id), args.repeat),
+    }
+
+
+@benchmark
+def script_latency(args) -> dict:
+    """Задержка от показания до ACK ведомого: check_scripts_for_sensor → хаб → пин актора.
+
+    Показания чередуются через порог, так что каждое меняет состояние актора;
+    замер длится, пока виртуальный ведомый не запишет новое значение пина.
+    """
+    main_bot = _import_main_bot()
+    channel, pin = _add_sensors(1)[0]
+    sensor_id = database.list_sensors()[-1]["id"]
+    actor_id = database.add_actor({"name": "bench", "description": "", "channel": channel, "pin": 3})
+    database.add_script({
+        "name": f"bench-{sensor_id}", "sensor_id": sensor_id, "threshold": 500,
+        "actor_id": actor_id, "actor_value": 255, "type_of_script": True,
+    })
+    slave = connect.ser.slave(channel)
+    readings = iter(range(10 ** 9))
+
+    def trigger():
+        value = 1000 if next(readings) % 2 else 0
+        expected = 255 if value >= 500 else 0
+        main_bot.check_scripts_for_sensor(sensor_id, value)
+        deadline = time.monotonic() + 5
+        while slave.pins.get(3) != expected:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"ведомый {channel} не подтвердил пин 3 = {expected}")
+            time.sleep(0.0001)
+
+    return _timings(trigger, args.repeat)
+
+
+@benchmark
+def sensor_data_query(args) -> dict:
+    """Время get_sensor_data / get_last_sensor_reading при разном объёме истории."""
+    result = {}
+    for rows in args.rows:
+        db_path = f"rows_{rows}.db"
+        database.init_db(db_path)
+        start = time.perf_counter()
+        _seed_readings(db_path, rows, sensors=10, span_sec=30 * 24 * 3600)
+        seed_sec = time.perf_counter() - start
+        result[str(rows)] = {
+            "seed_sec": round(seed_sec, 2),
+            "window_60_min": _timings(lambda: database.get_sensor_data(1, 60, db_path), args.repeat),
+            "window_10080_min": _timings(lambda: database.get_sensor_data(1, 10080, db_path), args.repeat),
+            "window_43200_min": _timings(lambda: database.get_sensor_data(1, 43200, db_path), args.repeat),
+            "last_reading": _timings(lambda: database.get_last_sensor_reading(1, db_path), args.repeat),
+        }
+    return result
+
+
+@benchmark
+def chart_render(args) -> dict:
+    """Время построения графика (неделя сырых показаний раз в 10 с): в процессе и через пул."""
+    import charts
+    db_path = "chart.db"
+    database.init_db(db_path)
+    _seed_readings(db_path, 7 * 24 * 360, sensors=1, span_sec=7 * 24 * 3600)
+    result = {}
+    repeat = max(1, args.repeat // 10)
+    for minutes in (60, 1440, 10080):
+        data = database.get_sensor_data(1, minutes, db_path)
+        points = [(r['ts'], r['value']) for r in data]
+        result[f"window_{minutes}_min"] = {
+            "points": len(data),
+            **_timings(lambda: charts.render(points), repeat),
+            "pool": _timings(lambda: charts.render_async(data).result(), repeat),
+        }
+    # для сравнения: неделя сырых показаний с прореживанием и без
+    with contextlib.closing(database.get_connection(db_path)) as conn:
+        points = conn.execute("SELECT ts, value FROM sensors_data WHERE sensor_id = 1 ORDER BY ts").fetchall()
+    result["raw_week"] = {
+        "points": len(points),
+        "lttb": _timings(lambda: charts.render(points), repeat),
+        "all_points": _timings(lambda: charts.render(points, len(points)), repeat),
+    }
+    charts.shutdown()
+    return result
+
+
+def _importtime(module: str) -> list[tuple[int, int, str]]:
+    """Импортирует module в чистом интерпретаторе с -X importtime.
+
+    Возвращает строки отчёта (self_us, cumulative_us, имя с отступом).
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode:
+        # как и в остальных бенчмарках: нет зависимости — пропускаем
+        raise ImportError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+@benchmark
+def import_time(args) -> dict:
+    """Время холодного импорта модулей бота (python -X importtime) и тяжёлые зависимости в нём."""
+    result = {}
+    for module in ("main_bot", "database", "charts", "neyro", "media"):
+        try:
+            runs = [_importtime(module) for _ in range(max(1, args.repeat // 10))]
+        except ImportError as e:
+            result[module] = {"skipped": str(e)}
+            continue
+        # лучший из прогонов — меньше всего шума от диска и планировщика ОС
+        rows = min(runs, key=lambda r: next(c for _, c, n in r if n.strip() == module))
+        total = next(c for _, c, n in rows if n.strip() == module)
+        loaded = {n.strip() for _, _, n in rows}
+        result[module] = {
+            "cumulative_ms": round(total / 1000, 1),
+            "heavy_loaded": sorted(m for m in HEAVY_MODULES if m in loaded),
+            # модули с наибольшим собственным временем импорта, мс
+            "slowest_self_ms": {n.strip(): round(own / 1000, 1)
+                                for own, _, n in sorted(rows, key=lambda r: -r[0])[:10]},
+        }
+    return result
+
+
+def _import_main_bot():
+    # main_bot тянет telebot (а с ним requests и aiohttp); без них бенчмарк пропускается
+    import main_bot
+    return main_bot
+
+
+def run(args) -> dict:
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="smart_home_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        database.init_db()
+        connect.init_ser(simulator.VirtualHub(latency=args.latency, time_scale=1.0, timeout=0.1))
+        for name, fn in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"→ {name}", file=sys.stderr)
+            try:
+                # connect печатает каждую строку хаба — глушим на время замера
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    report["results"][name] = fn(args)
+            except ImportError as e:
+                report["results"][name] = {"skipped": str(e)}
+    finally:
+        os.chdir(cwd)
+        # базы на миллионы строк не должны оставаться на SD-карте
+        database.close_databases()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(old: dict, new: dict, prefix: str = "") -> None:
+    """Печатает отношение new/old для всех числовых метрик."""
+    for key, value in new.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            compare(old[key], value, f"{name}.")
+        elif isinstance(value, (int, float)) and isinstance(old.get(key), (int, float)) and old[key]:
+            print(f"{name}: {old[key]} → {value} (×{value / old[key]:.2f})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="запустить только эти")
+    parser.add_argument("--sensors", type=int, default=1000, help="виртуальных датчиков")
+    parser.add_argument("--inserts", type=int, default=2000, help="вставок для add_data")
+    parser.add_argument("--rows", type=int, nargs="*", default=[1_000_000, 10_000_000],
+                        help="объёмы sensors_data для замера запросов")
+    parser.add_argument("--repeat", type=int, default=50, help="повторов каждого замера")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка виртуальных ведомых, с")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f)["results"], report["results"])
+
+
+if __name__ == "__main__":
+    main()
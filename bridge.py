@@ -0,0 +1,48 @@
+"""Мост между asyncio-фронтендом бота и блокирующими подсистемами.
+
+Обработчики не должны ждать SQLite, порт хаба, файлы или сеть в потоке
+цикла событий: такие вызовы уходят в ограниченные пулы потоков. Команды
+хабу сюда не относятся — actuators.set_value только ставит команду в
+очередь потока порта и ответа не ждёт.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+# Потоков под запросы к базе и под прочую блокирующую работу (файлы, генерация, сеть)
+DB_WORKERS = 4
+BLOCKING_WORKERS = 2
+
+_db_pool = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+_blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def _call(executor, fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_db(fn, *args, **kwargs):
+    """Выполняет fn (обычно из database) в пуле базы."""
+    return await _call(_db_pool, fn, *args, **kwargs)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Выполняет блокирующую fn в общем пуле, не занимая цикл событий."""
+    return await _call(_blocking_pool, fn, *args, **kwargs)
+
+
+class _Database:
+    """Awaitable-версия модуля database: await db.list_sensors()."""
+
+    def __getattr__(self, name):
+        fn = getattr(database, name)
+
+        async def call(*args, **kwargs):
+            return await run_db(fn, *args, **kwargs)
+        return call
+
+
+db = _Database()
@@ -0,0 +1,192 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from io import BytesIO
+
+# Размер картинки: 6.4×4.8 дюйма при 100 dpi — 640 точек по ширине
+CHART_SIZE = (6.4, 4.8)
+CHART_DPI = 100
+# Больше точек, чем пикселей по ширине, на графике всё равно не видно
+CHART_POINTS = int(CHART_SIZE[0] * CHART_DPI)
+# Процессов отрисовки: matplotlib держит GIL, поэтому рисуем вне процесса бота
+CHART_WORKERS = 1
+# Не fork: в боте уже работают потоки хаба, планировщика и базы, копия их блокировок
+# в дочернем процессе может остаться захваченной навсегда
+CHART_MP_CONTEXT = "spawn"
+# Кэш готовых PNG: общий объём и срок жизни картинки
+CHART_CACHE_BYTES = 8 * 1024 * 1024
+CHART_CACHE_TTL = 120
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+# ключ → (когда нарисован по time.monotonic(), PNG); порядок — от давно запрошенных к свежим
+_cache: "OrderedDict[tuple, tuple[float, bytes]]" = OrderedDict()
+_cache_bytes = 0
+# ключ → Future отрисовки, которая ещё идёт: одинаковые запросы ждут одну картинку
+_rendering: dict[tuple, Future] = {}
+_cache_lock = threading.Lock()
+
+
+def lttb(points: list[tuple[float, float]], threshold: int) -> list[tuple[float, float]]:
+    """Прореживание Largest-Triangle-Three-Buckets до threshold точек.
+
+    Точки (x, y) отсортированы по x. Из каждого бакета остаётся точка,
+    образующая наибольший треугольник с предыдущей выбранной и средним
+    следующего бакета, — пики и провалы сохраняются.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    every = (n - 2) / (threshold - 2)
+    sampled = [points[0]]
+    a = 0
+    for i in range(threshold - 2):
+        # среднее следующего бакета
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(p[0] for p in points[start:end]) / (end - start)
+        avg_y = sum(p[1] for p in points[start:end]) / (end - start)
+        # точка текущего бакета с наибольшей площадью треугольника
+        ax, ay = points[a]
+        best, best_area = start - 1, -1.0
+        for j in range(int(i * every) + 1, start):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def render(points: list[tuple[int, float]], max_points: int = CHART_POINTS) -> bytes:
+    """PNG-график показаний (ts, value) — в текущем процессе."""
+    # объектный API Agg: без глобального состояния pyplot
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    points = lttb(points, max_points)
+    times = [datetime.fromtimestamp(ts) for ts, _ in points]
+    vals = [value for _, value in points]
+    n = len(times)
+    if n > 1:
+        # 4 равных отрезка → 5 точек
+        idx = [int(i * (n-1) / 4) for i in range(5)]
+    else:
+        idx = list(range(n))
+    tcks = [times[i] for i in idx]
+
+    fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(times, vals)
+    ax.set_xticks(tcks)
+    ax.set_xticklabels([t.strftime('%H:%M') for t in tcks])
+    ax.set_xlabel('Время')
+    ax.set_ylabel('Значение')
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def render_async(data, max_points: int = CHART_POINTS) -> Future:
+    """Ставит отрисовку показаний (строки ts, value) в пул процессов.
+
+    Возвращает Future с байтами PNG; пропуски (value=None) отбрасываются.
+    """
+    global _pool
+    points = [(r['ts'], r['value']) for r in data if r['value'] is not None]
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool()
+        try:
+            return _pool.submit(render, points, max_points)
+        except BrokenProcessPool:
+            # процесс отрисовки упал — поднимаем пул заново
+            _pool = _new_pool()
+            return _pool.submit(render, points, max_points)
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                               mp_context=multiprocessing.get_context(CHART_MP_CONTEXT))
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def chart_async(key: tuple, load) -> Future | None:
+    """График по ключу (sensor_id, окно, разрешение, ts последнего показания).
+
+    Готовая картинка из кэша возвращается сразу (завершённый Future), такой
+    же график в работе — общим Future, иначе load() даёт строки показаний
+    и они уходят на отрисовку. None — показаний нет.
+    """
+    with _cache_lock:
+        png = _cached(key)
+        if png is not None:
+            future = Future()
+            future.set_result(png)
+            return future
+        future = _rendering.get(key)
+        if future is not None:
+            return future
+    data = load()
+    if not data:
+        return None
+    with _cache_lock:
+        future = _rendering.get(key)
+        if future is not None:
+            return future
+        future = _rendering[key] = render_async(data, key[2])
+    # уже завершённый Future (упавший пул) зовёт колбэк сразу в этом потоке,
+    # а _rendered берёт _cache_lock — поэтому только после выхода из блокировки
+    future.add_done_callback(lambda f: _rendered(key, f))
+    return future
+
+
+def _cached(key: tuple) -> bytes | None:
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] > CHART_CACHE_TTL:
+        _evict(key)
+        return None
+    _cache.move_to_end(key)
+    return entry[1]
+
+
+def _rendered(key: tuple, future: Future) -> None:
+    global _cache_bytes
+    with _cache_lock:
+        _rendering.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        png = future.result()
+        if key in _cache:
+            _evict(key)
+        _cache[key] = (time.monotonic(), png)
+        _cache_bytes += len(png)
+        # сначала устаревшие, потом давно не запрошенные — пока не влезем в объём
+        now = time.monotonic()
+        for old in [k for k, (at, _) in _cache.items() if now - at > CHART_CACHE_TTL]:
+            _evict(old)
+        while _cache_bytes > CHART_CACHE_BYTES and len(_cache) > 1:
+            _evict(next(iter(_cache)))
+
+
+def _evict(key: tuple) -> None:
+    global _cache_bytes
+    _cache_bytes -= len(_cache.pop(key)[1])
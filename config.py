@@ -1 +1,12 @@
-BOT_TOKEN = "YOURTELEGRAMAPITOKEN"
\ No newline at end of file
+BOT_TOKEN = "YOURTELEGRAMAPITOKEN"
+
+# Порт Arduino-мастера
+SERIAL_PORT = "COM11"
+# True — вместо настоящего хаба использовать simulator.VirtualHub
+HUB_SIMULATOR = False
+
+# Каталог медиафайлов для загрузки и воспроизведения
+MEDIA_DIR = r"G:\Kodi\22052025v1Kvant\home\files"
+
+# Локальный HTTP-порт метрик в формате Prometheus (None — не поднимать)
+METRICS_PORT = 9108
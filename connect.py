@@ -1,36 +1,203 @@
-import serial
 import time
+import queue
+import threading
+from concurrent.futures import Future
 
-def init_ser():
-    global ser
-    ser = serial.Serial('COM11', 9600, timeout=2) 
-    time.sleep(2)
+import metrics
 
-def sens(channel, pin):
-    global ser
-    message = f"g{channel},{pin}\n"  
-    print(f"{message.strip()}") 
-    ser.write(message.encode('utf-8'))
-    time.sleep(5)
+# Сколько ждём ответа хаба на одну команду: SLAVE_TIMEOUT мастера (3 с) плюс запас на радио
+HUB_TIMEOUT = 8
+# Сколько пинов помещается в одну команду m (MAX_BATCH_PINS в master.ino/slave.ino)
+MAX_BATCH_PINS = 8
+
+ser = None
+# Очередь команд к хабу: (строка команды, Future для ответа)
+_commands: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+_worker = None
+
+# по channel: доля таймаутов канала = hub_timeouts_total / hub_command_seconds_count;
+# в /stats каналы сводятся вместе, а по отдельности показываются только худшие
+HUB_SECONDS = metrics.Histogram("hub_command_seconds", "Время обмена командой с хабом, с",
+                                labels=("command", "channel"), summary_labels=("command",))
+HUB_TIMEOUTS = metrics.Counter("hub_timeouts_total", "Ведомый или хаб не ответил, по каналам",
+                               labels=("channel",), summary_labels=())
+# Сколько каналов с наибольшей долей таймаутов показывать в /stats
+HUB_WORST_CHANNELS = 5
+metrics.Gauge("hub_queue_length", "Команд в очереди к хабу", _commands.qsize)
+
+
+class SerialTransport:
+    """Настоящий хаб: Arduino-мастер на последовательном порту.
+
+    Транспорт — любой объект с write(bytes) и readline() -> bytes
+    (readline возвращает b"" по таймауту), например simulator.VirtualHub.
+    """
+
+    def __init__(self, port: str = 'COM11', baudrate: int = 9600, timeout: float = 2):
+        import serial
+        self._ser = serial.Serial(port, baudrate, timeout=timeout)
+        time.sleep(2)  # мастер перезагружается при открытии порта
+
+    def write(self, data: bytes) -> int:
+        return self._ser.write(data)
+
+    def readline(self) -> bytes:
+        return self._ser.readline()
+
+    def close(self) -> None:
+        self._ser.close()
+
+
+def init_ser(transport=None, port: str = 'COM11'):
+    """Подключает хаб: transport или настоящий порт port."""
+    global ser, _worker
+    ser = transport if transport is not None else SerialTransport(port)
+    if _worker is None:
+        # Единственный поток-владелец порта: только он пишет в ser и читает из него
+        _worker = threading.Thread(target=_serial_loop, name="serial-hub", daemon=True)
+        _worker.start()
+
+
+def _serial_loop():
     while True:
-        time.sleep(1) 
-        response = ser.readline().decode('utf-8').strip() # Считываем строку и декодируем.
+        command, future = _commands.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        start = time.perf_counter()
+        try:
+            future.set_result(_exchange(command))
+        except Exception as e:
+            future.set_exception(e)
+        HUB_SECONDS.observe(time.perf_counter() - start, command[0], _channel(command))
+
+
+def _exchange(command: str):
+    """Отправляет команду и ждёт именно её ответ.
+
+    Мастер обрабатывает команды строго по одной и перед обработкой печатает
+    эхо «DEBUG: Received hub command: ...». Всё, что пришло до эха, —
+    хвосты прошлых команд, их пропускаем.
+    """
+    print(command)
+    ser.write(f"{command}\n".encode('utf-8'))
+    echo = f"DEBUG: Received hub command: {command}"
+    echoed = False
+    deadline = time.monotonic() + HUB_TIMEOUT
+    while time.monotonic() < deadline:
+        response = ser.readline().decode('utf-8', errors='replace').strip() # Считываем строку и декодируем.
+        if not response:
+            continue
         print(f"Я получил {response}")
+        if not echoed:
+            echoed = response == echo
+            continue
+        done, result = _parse_reply(command, response)
+        if done:
+            if response.startswith("ERROR: Timeout"):
+                HUB_TIMEOUTS.inc(_channel(command))
+            return result
+    print(f"Нет ответа хаба на {command}")
+    HUB_TIMEOUTS.inc(_channel(command))
+    return _failed(command)
+
+
+def _worst_channels() -> list[str]:
+    commands: dict[str, int] = {}
+    for (_, channel), (_, _, count) in HUB_SECONDS.snapshot():
+        commands[channel] = commands.get(channel, 0) + count
+    ratios = sorted(((timeouts / commands[channel], channel, timeouts)
+                     for (channel,), timeouts in HUB_TIMEOUTS.samples() if commands.get(channel)),
+                    reverse=True)[:HUB_WORST_CHANNELS]
+    if not ratios:
+        return []
+    return ["Худшие каналы по таймаутам: " + ", ".join(
+        f"{channel} — {timeouts:g}/{commands[channel]} ({ratio:.0%})" for ratio, channel, timeouts in ratios)]
+
+
+metrics.add_summary(_worst_channels)
+
+
+def _channel(command: str) -> str:
+    return command[1:].split(',', 1)[0]
+
+
+def _failed(command: str):
+    if command[0] == 'g':
+        return float('nan')
+    if command[0] == 'm':
+        return []
+    return "ERROR: Timeout"
+
+
+def _parse_reply(command: str, response: str):
+    """Возвращает (True, результат), если строка завершает ответ на command."""
+    if command[0] == 'm':
+        # Ответ на пакетный опрос — значения через запятую в порядке пинов
         try:
-            response = int(response)
-            break
+            return True, [int(v) for v in response.split(',')]
         except ValueError:
-            if "ERROR: Timeout, no response from slave" in response:
-                response=float('nan')
-                break
-            continue
-        
-    return response
+            if response.startswith("ERROR:"):
+                return True, []
+            return False, None
+    if command[0] == 'g':
+        try:
+            return True, int(response)
+        except ValueError:
+            if response.startswith("ERROR:"):
+                return True, float('nan')
+            return False, None
+    if response == "OK" or response.startswith("ERROR:"):
+        return True, response
+    return False, None
+
+
+def submit(command: str) -> Future:
+    """Ставит команду в очередь к хабу и сразу возвращает Future с ответом."""
+    future = Future()
+    _commands.put((command, future))
+    return future
+
+
+def sens_async(channel, pin) -> Future:
+    return submit(f"g{channel},{pin}")
+
+
+def act_async(channel, pin, set) -> Future:
+    return submit(f"s{channel},{pin},{set}")
+
+
+def sens_many_async(channel, pins) -> Future:
+    """Один обмен с ведомым: значения всех pins (не больше MAX_BATCH_PINS)."""
+    return submit(f"m{channel}," + ",".join(str(p) for p in pins))
+
+
+def sens(channel, pin):
+    return sens_async(channel, pin).result()
+
 
 def act(channel,pin,set):
-    global ser
-    message = f"s{channel},{pin},{set}\n"  
-    print(f"{message.strip()}") 
-    ser.write(message.encode('utf-8')) 
-    response = ser.readline().decode('utf-8').strip() # Считываем строку и декодируем.
-    return response
\ No newline at end of file
+    return act_async(channel, pin, set).result()
+
+
+def sens_many(requests):
+    """Опрашивает список (channel, pin) и возвращает значения в том же порядке.
+
+    Пины одного ведомого уходят одной командой m (по MAX_BATCH_PINS за обмен),
+    недополученные значения — nan.
+    """
+    by_channel: dict = {}
+    for i, (channel, pin) in enumerate(requests):
+        by_channel.setdefault(channel, []).append((i, pin))
+
+    batches = []
+    for channel, items in by_channel.items():
+        for start in range(0, len(items), MAX_BATCH_PINS):
+            chunk = items[start:start + MAX_BATCH_PINS]
+            batches.append((chunk, sens_many_async(channel, [pin for _, pin in chunk])))
+
+    values = [float('nan')] * len(requests)
+    for chunk, future in batches:
+        result = future.result()
+        for (i, _), value in zip(chunk, result):
+            values[i] = value
+    return values
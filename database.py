@@ -1,17 +1,175 @@
 import sqlite3
+import threading
+import queue
+import time
+import atexit
+from concurrent.futures import Future
 import connect
-from contextlib import closing
+import metrics
+import ringbuffer
+import rules
+from contextlib import contextmanager
+
+# Соединения живут всё время работы потока: {db_path: Connection} в каждом потоке
+_local = threading.local()
 
 def get_connection(db_path: str = "smart_home.db") -> sqlite3.Connection:
-    """Открывает соединение с базой и настраивает row_factory."""
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    """Открывает новое соединение с базой и настраивает row_factory и PRAGMA."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # первым делом: следующие PRAGMA тоже могут ждать блокировку
+    conn.execute("PRAGMA busy_timeout=5000")
+    # действует только на новой базе и до перехода в WAL; старые — enable_incremental_vacuum
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL: читатели не блокируют писателя; NORMAL в WAL безопасен при сбое питания
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-8000")  # 8 МБ
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
 
+@contextmanager
+def connection(db_path: str = "smart_home.db"):
+    """Соединение текущего потока с db_path; открывается один раз на поток.
+
+    Незавершённая транзакция откатывается при исключении, чтобы не
+    достаться следующему вызову в этом же потоке.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = get_connection(db_path)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def close_connections() -> None:
+    """Закрывает соединения текущего потока."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+SENSORS_DATA_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sensor_id INTEGER,
+        ts INTEGER NOT NULL,
+        value REAL,
+        FOREIGN KEY(sensor_id) REFERENCES sensors(id)
+    )
+'''
+
+# Агрегаты показаний по минутам и часам: (таблица, шаг в секундах).
+# Пополняются при записи каждой пачки показаний.
+ROLLUPS = (("sensors_data_1m", 60), ("sensors_data_1h", 3600))
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        sensor_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,  -- начало интервала, секунды Unix
+        value_min REAL,
+        value_max REAL,
+        value_sum REAL,
+        value_count INTEGER,
+        PRIMARY KEY (sensor_id, bucket)
+    ) WITHOUT ROWID
+'''
+
+# Версия схемы хранится в PRAGMA user_version
+SCHEMA_VERSION = 3
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Доводит схему старой базы до SCHEMA_VERSION."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        columns = [r["name"] for r in conn.execute("PRAGMA table_info(sensors_data)")]
+        if "ts" not in columns:
+            # 0 → 1: timestamp (TEXT, localtime) → ts (INTEGER, UTC); таблица пересобирается
+            print("Миграция sensors_data: перевод времени показаний в целые секунды...")
+            conn.execute("BEGIN")
+            conn.execute(SENSORS_DATA_SCHEMA.format(table="sensors_data_new"))
+            conn.execute('''
+                INSERT INTO sensors_data_new (id, sensor_id, ts, value)
+                SELECT id, sensor_id,
+                       COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+                                CAST(strftime('%s', 'now') AS INTEGER)),
+                       value
+                  FROM sensors_data
+            ''')
+            conn.execute("DROP TABLE sensors_data")
+            conn.execute("ALTER TABLE sensors_data_new RENAME TO sensors_data")
+            conn.commit()
+    if version < 2 and conn.execute("SELECT 1 FROM sensors_data LIMIT 1").fetchone():
+        # 1 → 2: агрегаты строятся по уже накопленной истории
+        print("Миграция sensors_data: построение минутных и часовых агрегатов...")
+        _backfill_rollups(conn)
+        conn.commit()
+    if version < 3 and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # 2 → 3: у старой базы режим auto_vacuum включается только полным VACUUM —
+        # при старте его не делаем (минуты на SD-карте и вдвое больше места).
+        # Без него compact_step всё равно удаляет строки, их страницы переиспользуются,
+        # просто файл не уменьшается; сжать можно вручную: python database.py vacuum
+        print("Файл базы не будет уменьшаться после очистки: запустите python database.py vacuum при остановленном боте")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _backfill_rollups(conn: sqlite3.Connection) -> None:
+    for table, step in ROLLUPS:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f'''
+            INSERT INTO {table} (sensor_id, bucket, value_min, value_max, value_sum, value_count)
+            SELECT sensor_id, ts - ts % {step}, MIN(value), MAX(value), SUM(value), COUNT(value)
+              FROM sensors_data
+             WHERE value IS NOT NULL
+             GROUP BY sensor_id, ts - ts % {step}
+        ''')
+
+
+def rebuild_rollups(db_path: str = "smart_home.db") -> None:
+    """Пересчитывает агрегаты по всей sensors_data (после массовой заливки)."""
+    with connection(db_path) as conn:
+        _backfill_rollups(conn)
+        conn.commit()
+
+
+def _update_rollups(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Добавляет пачку показаний (sensor_id, value, ts) в агрегаты."""
+    for table, step in ROLLUPS:
+        agg: dict[tuple[int, int], list] = {}
+        for sensor_id, value, ts in rows:
+            if value is None or value != value:  # nan — нет ответа от ведомого
+                continue
+            key = (sensor_id, ts - ts % step)
+            a = agg.get(key)
+            if a is None:
+                agg[key] = [value, value, value, 1]
+            else:
+                a[0] = min(a[0], value)
+                a[1] = max(a[1], value)
+                a[2] += value
+                a[3] += 1
+        conn.executemany(f'''
+            INSERT INTO {table} (sensor_id, bucket, value_min, value_max, value_sum, value_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sensor_id, bucket) DO UPDATE SET
+                value_min = min(value_min, excluded.value_min),
+                value_max = max(value_max, excluded.value_max),
+                value_sum = value_sum + excluded.value_sum,
+                value_count = value_count + excluded.value_count
+        ''', [(sensor_id, bucket, *a) for (sensor_id, bucket), a in agg.items()])
+
+
 def init_db(db_path: str = "smart_home.db") -> None:
     """Инициализирует все необходимые таблицы."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
 
         # Таблица сенсоров
@@ -41,15 +199,15 @@ def init_db(db_path: str = "smart_home.db") -> None:
             )
         ''')
 
-        # Таблица данных сенсоров
+        # Таблица данных сенсоров: ts — время показания в секундах Unix (UTC)
+        c.execute(SENSORS_DATA_SCHEMA.format(table="sensors_data"))
+        for table, _ in ROLLUPS:
+            c.execute(ROLLUP_SCHEMA.format(table=table))
+        _migrate(conn)
+        # Покрывающий индекс: окно и последнее значение сенсора без чтения таблицы
         c.execute('''
-            CREATE TABLE IF NOT EXISTS sensors_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sensor_id INTEGER,
-                timestamp DATETIME DEFAULT (datetime('now','localtime')),
-                value REAL,
-                FOREIGN KEY(sensor_id) REFERENCES sensors(id)
-            )
+            CREATE INDEX IF NOT EXISTS idx_sensors_data_sensor_ts
+                ON sensors_data (sensor_id, ts, value)
         ''')
 
         # Таблица сценариев
@@ -83,9 +241,41 @@ def init_db(db_path: str = "smart_home.db") -> None:
 
 # ————— Функции для работы с сенсорами —————
 
+# Кэш таблицы sensors для каждой базы: (строки по id, id по (channel, pin)).
+# Сбрасывается в add_sensor/update_sensor/delete_sensor, поколение защищает
+# от записи в кэш строк, прочитанных до сброса.
+_sensor_cache: dict[str, tuple[dict[int, sqlite3.Row], dict[tuple[int, int], int]]] = {}
+_sensor_generation: dict[str, int] = {}
+
+
+def _sensor_registry(db_path: str):
+    cached = _sensor_cache.get(db_path)
+    if cached is None:
+        generation = _sensor_generation.get(db_path, 0)
+        with connection(db_path) as conn:
+            rows = conn.execute("SELECT * FROM sensors ORDER BY id").fetchall()
+        by_key: dict[tuple[int, int], int] = {}
+        for r in rows:
+            by_key.setdefault((r["channel"], r["pin"]), r["id"])
+        cached = ({r["id"]: r for r in rows}, by_key)
+        if _sensor_generation.get(db_path, 0) == generation:
+            _sensor_cache[db_path] = cached
+    return cached
+
+
+def _invalidate_sensors(db_path: str) -> None:
+    _sensor_generation[db_path] = _sensor_generation.get(db_path, 0) + 1
+    _sensor_cache.pop(db_path, None)
+
+
+def find_sensor_id(channel: int, pin: int, db_path: str = "smart_home.db") -> int | None:
+    """Возвращает id сенсора по (channel, pin) без запроса к базе."""
+    return _sensor_registry(db_path)[1].get((channel, pin))
+
+
 def add_sensor(data: dict, db_path: str = "smart_home.db") -> int:
     """Добавляет новый сенсор и возвращает его id."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute('''
             INSERT INTO sensors
@@ -97,74 +287,197 @@ def add_sensor(data: dict, db_path: str = "smart_home.db") -> int:
             data["interval_sec"]
         ))
         conn.commit()
+        _invalidate_sensors(db_path)
         return c.lastrowid
 
 
 def list_sensors(db_path: str = "smart_home.db") -> list[sqlite3.Row]:
     """Возвращает список всех сенсоров."""
-    with closing(get_connection(db_path)) as conn:
-        c = conn.cursor()
-        c.execute("SELECT * FROM sensors")
-        return c.fetchall()
+    return list(_sensor_registry(db_path)[0].values())
 
 
 def get_sensor_by_id(sensor_id: int, db_path: str = "smart_home.db") -> sqlite3.Row | None:
     """Возвращает запись сенсора по его ID."""
-    with closing(get_connection(db_path)) as conn:
-        c = conn.cursor()
-        c.execute("SELECT * FROM sensors WHERE id = ?", (sensor_id,))
-        return c.fetchone()
+    return _sensor_registry(db_path)[0].get(sensor_id)
     
 def get_actor_by_id(actor_id: int, db_path: str = "smart_home.db") -> sqlite3.Row | None:
     """Возвращает запись актора по его ID."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM actors WHERE id = ?", (actor_id,))
         return c.fetchone()
 
 def update_sensor(sensor_id: int, field: str, value, db_path: str = "smart_home.db") -> None:
     """Обновляет одно поле сенсора."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute(
             f"UPDATE sensors SET {field} = ? WHERE id = ?",
             (value, sensor_id)
         )
         conn.commit()
+        _invalidate_sensors(db_path)
+    if field == "interval_sec":
+        ring = _rings.get(db_path, {}).get(sensor_id)
+        if ring is not None:
+            ring.resize(_ring_capacity(sensor_id, db_path))
 
 
 def delete_sensor(sensor_id: int, db_path: str = "smart_home.db") -> None:
     """Удаляет сенсор и все его показания."""
-    with closing(get_connection(db_path)) as conn:
+    # показания из очереди записи не должны пережить удаление
+    flush_data(db_path)
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("DELETE FROM sensors WHERE id = ?", (sensor_id,))
         c.execute("DELETE FROM sensors_data WHERE sensor_id = ?", (sensor_id,))
+        for table, _ in ROLLUPS:
+            c.execute(f"DELETE FROM {table} WHERE sensor_id = ?", (sensor_id,))
         conn.commit()
+        _invalidate_sensors(db_path)
+    _rings.get(db_path, {}).pop(sensor_id, None)
+
+
+# ————— Очистка старых показаний —————
+
+# Сколько дней хранить каждый уровень детализации (None — всегда).
+# Сырые показания уже свёрнуты в агрегаты при записи, поэтому их можно удалять раньше.
+RETENTION_DAYS = {
+    "sensors_data": 30,
+    "sensors_data_1m": 365,
+    "sensors_data_1h": None,
+}
+# Строк на одно удаление: запись блокируется ненадолго и не мешает опросу
+RETENTION_BATCH = 1000
+# Страниц, возвращаемых ОС за один шаг
+VACUUM_PAGES = 256
+
+
+def compact_step(db_path: str = "smart_home.db", batch: int = RETENTION_BATCH) -> int:
+    """Один шаг очистки: не больше batch строк на сенсор и таблицу.
+
+    Возвращает число удалённых строк — 0 значит, что устаревших данных нет.
+    """
+    now = int(time.time())
+    deleted = 0
+    with connection(db_path) as conn:
+        for sensor_id in list(_sensor_registry(db_path)[0]):
+            for table, days in RETENTION_DAYS.items():
+                if days is None:
+                    continue
+                if table == "sensors_data":
+                    cur = conn.execute('''
+                        DELETE FROM sensors_data WHERE rowid IN (
+                            SELECT rowid FROM sensors_data
+                             WHERE sensor_id = ? AND ts < ? LIMIT ?)
+                    ''', (sensor_id, now - days * 86400, batch))
+                else:
+                    cur = conn.execute(f'''
+                        DELETE FROM {table} WHERE (sensor_id, bucket) IN (
+                            SELECT sensor_id, bucket FROM {table}
+                             WHERE sensor_id = ? AND bucket < ? LIMIT ?)
+                    ''', (sensor_id, now - days * 86400, batch))
+                conn.commit()
+                deleted += cur.rowcount
+        # executescript прогоняет PRAGMA до конца; execute освободил бы одну страницу
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+        # освобождённые страницы уходят из файла только после checkpoint WAL
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return deleted
+
+
+# Сколько точек достаточно для графика: берётся самый грубый агрегат,
+# который даёт за окно не меньше стольких интервалов
+ROLLUP_MIN_POINTS = 150
+
+
+# Последние показания каждого сенсора в памяти: {db_path: {sensor_id: SensorRing}}.
+# Отвечают на запросы последнего значения и коротких окон без SQL;
+# если окно старше самого старого показания в кольце — читаем базу.
+_rings: dict[str, dict[int, ringbuffer.SensorRing]] = {}
+
+
+def _remember(sensor_id: int, ts: int, value: float, db_path: str) -> None:
+    rings = _rings.setdefault(db_path, {})
+    ring = rings.get(sensor_id)
+    if ring is None:
+        ring = rings.setdefault(sensor_id, _load_ring(sensor_id, db_path))
+    ring.append(ts, value)
+
+
+def _ring_capacity(sensor_id: int, db_path: str) -> int:
+    # из кольца читаются только окна короче ROLLUP_MIN_POINTS минут
+    sensor = get_sensor_by_id(sensor_id, db_path)
+    return ringbuffer.capacity_for(sensor["interval_sec"] if sensor else None, ROLLUP_MIN_POINTS * 60)
+
+
+def _load_ring(sensor_id: int, db_path: str) -> ringbuffer.SensorRing:
+    """Новое кольцо, заполненное последними показаниями из базы."""
+    ring = ringbuffer.SensorRing(_ring_capacity(sensor_id, db_path))
+    with connection(db_path) as conn:
+        rows = conn.execute('''
+            SELECT ts, value
+              FROM sensors_data
+             WHERE sensor_id = ?
+             ORDER BY ts DESC
+             LIMIT ?
+        ''', (sensor_id, ring.capacity + 1)).fetchall()
+    for r in reversed(rows):
+        ring.append(r["ts"], float("nan") if r["value"] is None else r["value"])
+    return ring
+
+
+def _reading(ts: int, value: float) -> dict:
+    """Показание из кольца в том же виде, что строка базы (nan в базе — NULL)."""
+    return {"ts": ts, "value": None if value != value else value}
 
 
 def get_sensor_data(sensor_id: int, minutes: int, db_path: str = "smart_home.db") -> list[sqlite3.Row]:
-    """Возвращает показания за последние `minutes` минут."""
-    with closing(get_connection(db_path)) as conn:
+    """Возвращает показания (ts, value) за последние `minutes` минут.
+
+    Для длинных окон вместо сырых показаний — средние по минутам или часам.
+    """
+    cutoff = int(time.time()) - minutes * 60
+    ring = _rings.get(db_path, {}).get(sensor_id)
+    if ring is not None and minutes < ROLLUP_MIN_POINTS:
+        recent = ring.since(cutoff)
+        if recent is not None:
+            return [_reading(ts, value) for ts, value in recent]
+    with connection(db_path) as conn:
         c = conn.cursor()
+        for table, step in reversed(ROLLUPS):
+            if minutes * 60 // step >= ROLLUP_MIN_POINTS:
+                c.execute(f'''
+                    SELECT bucket AS ts, value_sum / value_count AS value
+                      FROM {table}
+                     WHERE sensor_id = ?
+                       AND bucket >= ?
+                     ORDER BY bucket
+                ''', (sensor_id, cutoff - cutoff % step))
+                return c.fetchall()
         c.execute('''
-            SELECT timestamp, value
+            SELECT ts, value
               FROM sensors_data
              WHERE sensor_id = ?
-               AND timestamp >= datetime('now', ?)
-             ORDER BY timestamp
-        ''', (sensor_id, f"-{minutes} minutes"))
+               AND ts >= ?
+             ORDER BY ts
+        ''', (sensor_id, cutoff))
         return c.fetchall()
 
 
 def get_last_sensor_reading(sensor_id: int, db_path: str = "smart_home.db") -> sqlite3.Row | None:
-    """Возвращает последнее показание сенсора."""
-    with closing(get_connection(db_path)) as conn:
+    """Возвращает последнее показание сенсора (ts, value)."""
+    ring = _rings.get(db_path, {}).get(sensor_id)
+    last = ring.last() if ring is not None else None
+    if last is not None:
+        return _reading(*last)
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute('''
-            SELECT timestamp, value
+            SELECT ts, value
               FROM sensors_data
              WHERE sensor_id = ?
-             ORDER BY timestamp DESC
+             ORDER BY ts DESC
              LIMIT 1
         ''', (sensor_id,))
         return c.fetchone()
@@ -173,7 +486,7 @@ def get_last_sensor_reading(sensor_id: int, db_path: str = "smart_home.db") -> s
 
 def add_actor(data: dict, db_path: str = "smart_home.db") -> int:
     """Добавляет нового актора и возвращает его id."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         # duration и value могут отсутствовать в data
         duration = data.get("duration", 0)
@@ -193,7 +506,7 @@ def add_actor(data: dict, db_path: str = "smart_home.db") -> int:
 
 def list_actors(db_path: str = "smart_home.db") -> list[sqlite3.Row]:
     """Возвращает список всех акторов."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM actors")
         return c.fetchall()
@@ -201,43 +514,206 @@ def list_actors(db_path: str = "smart_home.db") -> list[sqlite3.Row]:
 
 def update_actor(actor_id: int, field: str, value, db_path: str = "smart_home.db") -> None:
     """Обновляет одно поле актора."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute(
             f"UPDATE actors SET {field} = ? WHERE id = ?",
             (value, actor_id)
         )
         conn.commit()
+    _refresh_actor_rules(actor_id, db_path)
 
 
 def delete_actor(actor_id: int, db_path: str = "smart_home.db") -> None:
     """Удаляет актора."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("DELETE FROM actors WHERE id = ?", (actor_id,))
         conn.commit()
+    _refresh_actor_rules(actor_id, db_path)
 
 # ————— Функции для работы с данными сенсоров по channel/pin —————
 
+# Отложенная запись показаний: пачка пишется одной транзакцией,
+# как только наберётся INGEST_BATCH штук или пройдёт INGEST_INTERVAL_MS
+INGEST_BATCH = 200
+INGEST_INTERVAL_MS = 500
+# Больше показаний в очереди не держим — add_data будет ждать (backpressure);
+# столько же держим и неудачно записанных, сверх — выбрасываем самые старые
+INGEST_QUEUE_SIZE = 10000
+# Пауза перед повтором записи после временной ошибки: удваивается от MIN до MAX, с
+INGEST_RETRY_MIN = 0.5
+INGEST_RETRY_MAX = 30.0
+# Ошибки, которые проходят сами: база занята (compact_step, checkpoint, бэкап), сбой ввода-вывода, нет места
+_RETRYABLE_ERRORS = {5, 6, 10, 13}  # SQLITE_BUSY, SQLITE_LOCKED, SQLITE_IOERR, SQLITE_FULL
+
+_STOP = object()
+
+
+class IngestBuffer:
+    """Очередь показаний для одной базы и фоновый поток, пишущий их пачками."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._queue: queue.Queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._loop, name=f"ingest-{db_path}", daemon=True)
+        self._thread.start()
+
+    def put(self, sensor_id: int, value: float, ts: int) -> None:
+        self._queue.put((sensor_id, value, ts))
+
+    def flush(self) -> None:
+        """Ждёт, пока всё поставленное в очередь окажется в базе.
+
+        Если запись не проходит и пауза между повторами дошла до
+        INGEST_RETRY_MAX, поднимает последнюю ошибку sqlite3 (показания
+        остаются в очереди и повторяются дальше).
+        """
+        done = Future()
+        self._queue.put(done)
+        done.result()
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _loop(self) -> None:
+        pending, waiters = [], []
+        deadline = 0.0
+        retry = 0.0  # пауза после последней временной ошибки, 0 — ошибок нет
+        while True:
+            timeout = max(0, deadline - time.monotonic()) if pending else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            # пока не вышла пауза после ошибки, только копим показания и ждущих flush
+            backoff = retry and time.monotonic() < deadline
+            if isinstance(item, tuple):
+                if not pending:
+                    deadline = time.monotonic() + INGEST_INTERVAL_MS / 1000
+                pending.append(item)
+                if len(pending) > INGEST_QUEUE_SIZE:
+                    self._drop(pending[:len(pending) - INGEST_QUEUE_SIZE], "переполнение")
+                    del pending[:len(pending) - INGEST_QUEUE_SIZE]
+                if len(pending) < INGEST_BATCH or backoff:
+                    continue
+            elif isinstance(item, Future):
+                waiters.append(item)
+                if backoff:
+                    continue
+            error = self._write(pending)
+            if error is not None:
+                if item is not _STOP:
+                    retry = min(retry * 2 or INGEST_RETRY_MIN, INGEST_RETRY_MAX)
+                    deadline = time.monotonic() + retry
+                    if retry >= INGEST_RETRY_MAX:
+                        # база не оживает — ждущие flush получают ошибку, а не висят без конца
+                        self._release(waiters, error)
+                        waiters = []
+                    continue
+                # при остановке повторять некому
+                self._drop(pending, "остановка")
+            pending, retry = [], 0.0
+            self._release(waiters, error)
+            waiters = []
+            if item is _STOP:
+                close_connections()
+                return
+
+    @staticmethod
+    def _release(waiters: list[Future], error: Exception | None) -> None:
+        for w in waiters:
+            if error is None:
+                w.set_result(None)
+            else:
+                w.set_exception(error)
+
+    def _drop(self, rows: list[tuple], reason: str) -> None:
+        print(f"Потеряно показаний: {len(rows)} ({reason})")
+        INGEST_DROPPED.inc(amount=len(rows))
+
+    def _write(self, rows: list[tuple]) -> sqlite3.Error | None:
+        """Пишет пачку; возвращает временную ошибку, если пачку надо повторить позже."""
+        if not rows:
+            return None
+        start = time.perf_counter()
+        try:
+            with connection(self.db_path) as conn:
+                conn.executemany(
+                    "INSERT INTO sensors_data (sensor_id, value, ts) VALUES (?, ?, ?)",
+                    rows
+                )
+                _update_rollups(conn, rows)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка записи показаний: {e}")
+            code = getattr(e, "sqlite_errorcode", None)
+            if code is None and isinstance(e, sqlite3.OperationalError) or code is not None and code & 0xff in _RETRYABLE_ERRORS:
+                return e
+            # ошибка не пройдёт от повтора (битые данные, нет таблицы) — пачку не спасти
+            self._drop(rows, str(e))
+            return None
+        INGEST_COMMIT_SECONDS.observe(time.perf_counter() - start)
+        INGEST_ROWS.inc(amount=len(rows))
+        return None
+
+
+INGEST_COMMIT_SECONDS = metrics.Histogram("db_ingest_commit_seconds", "Запись пачки показаний с commit, с")
+INGEST_ROWS = metrics.Counter("db_ingest_rows_total", "Записано показаний")
+INGEST_DROPPED = metrics.Counter("db_ingest_dropped_total", "Показаний, которые не удалось записать и пришлось выбросить")
+
+_buffers: dict[str, IngestBuffer] = {}
+_buffers_lock = threading.Lock()
+
+
+def _buffer(db_path: str) -> IngestBuffer:
+    buf = _buffers.get(db_path)
+    if buf is None:
+        with _buffers_lock:
+            buf = _buffers.get(db_path)
+            if buf is None:
+                buf = _buffers[db_path] = IngestBuffer(db_path)
+    return buf
+
+
 def add_data(channel: int, pin: int, value: float, db_path: str = "smart_home.db") -> None:
     """
-    Находит сенсор по (channel, pin) и записывает в sensors_data.
+    Ставит показание сенсора (channel, pin) в очередь на запись в sensors_data.
     Ничего не делает, если сенсор не найден.
     """
-    with closing(get_connection(db_path)) as conn:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id FROM sensors WHERE channel = ? AND pin = ?",
-            (channel, pin)
-        )
-        row = c.fetchone()
-        if row:
-            sensor_id = row["id"]
-            c.execute(
-                "INSERT INTO sensors_data (sensor_id, value) VALUES (?, ?)",
-                (sensor_id, value)
-            )
-            conn.commit()
+    sensor_id = find_sensor_id(channel, pin, db_path)
+    if sensor_id is not None:
+        add_data_by_id(sensor_id, value, db_path)
+
+
+def add_data_by_id(sensor_id: int, value: float, db_path: str = "smart_home.db") -> None:
+    """Ставит показание сенсора с известным id в очередь на запись."""
+    ts = int(time.time())
+    _remember(sensor_id, ts, value, db_path)
+    _buffer(db_path).put(sensor_id, value, ts)
+
+
+def flush_data(db_path: str = "smart_home.db") -> None:
+    """Дописывает в базу все показания из очереди; sqlite3.Error — база долго недоступна."""
+    if db_path in _buffers:
+        _buffers[db_path].flush()
+
+
+@atexit.register
+def _close_buffers() -> None:
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+        _buffers.clear()
+    for buf in buffers:
+        buf.close()
+
+
+def close_databases() -> None:
+    """Дописывает очереди показаний, останавливает их потоки и закрывает
+    соединения текущего потока — после этого файлы баз можно удалять."""
+    _close_buffers()
+    close_connections()
 
 
 def get_data(channel: int, pin: int) -> float:
@@ -245,11 +721,51 @@ def get_data(channel: int, pin: int) -> float:
     add_data(channel, pin, value)
     return value
 
+
+def get_data_many(requests: list[tuple[int, int]]) -> list[float]:
+    """Опрашивает несколько (channel, pin) пакетно и сохраняет все показания."""
+    values = connect.sens_many(requests)
+    for (channel, pin), value in zip(requests, values):
+        add_data(channel, pin, value)
+    return values
+
 # ————— Функции для работы с администраторами —————
 
+# Множество администраторов для проверки прав на каждом сообщении: (когда прочитано, имена).
+# Сбрасывается в add_admin_db/delete_admin_db, правки в обход бота подхватываются через TTL.
+ADMIN_CACHE_TTL = 60
+_admin_cache: dict[str, tuple[float, frozenset[str]]] = {}
+_admin_generation: dict[str, int] = {}
+
+
+def is_admin(username: str, db_path: str = "smart_home.db") -> bool:
+    """Есть ли username (с @) среди администраторов; без запроса к базе, пока кэш свеж."""
+    admin = cached_is_admin(username, db_path)
+    if admin is not None:
+        return admin
+    generation = _admin_generation.get(db_path, 0)
+    cached = (time.monotonic(), frozenset(list_admins(db_path)))
+    if _admin_generation.get(db_path, 0) == generation:
+        _admin_cache[db_path] = cached
+    return username in cached[1]
+
+
+def cached_is_admin(username: str, db_path: str = "smart_home.db") -> bool | None:
+    """Ответ is_admin из кэша или None, если кэш пуст или устарел — тогда нужен is_admin."""
+    cached = _admin_cache.get(db_path)
+    if cached is None or time.monotonic() - cached[0] > ADMIN_CACHE_TTL:
+        return None
+    return username in cached[1]
+
+
+def _invalidate_admins(db_path: str) -> None:
+    _admin_generation[db_path] = _admin_generation.get(db_path, 0) + 1
+    _admin_cache.pop(db_path, None)
+
+
 def list_admins(db_path: str = "smart_home.db") -> list[str]:
     """Возвращает список всех администраторов."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT username FROM admins")
         return [row["username"] for row in c.fetchall()]
@@ -257,28 +773,30 @@ def list_admins(db_path: str = "smart_home.db") -> list[str]:
 
 def add_admin_db(username: str, db_path: str = "smart_home.db") -> None:
     """Добавляет нового администратора."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute(
             "INSERT OR IGNORE INTO admins (username) VALUES (?)",
             (username,)
         )
         conn.commit()
+    _invalidate_admins(db_path)
 
 
 def delete_admin_db(username: str, db_path: str = "smart_home.db") -> None:
     """Удаляет администратора."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute(
             "DELETE FROM admins WHERE username = ?",
             (username,)
         )
         conn.commit()
+    _invalidate_admins(db_path)
 
 
 def add_script(data, db_path="smart_home.db") -> int:
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute('''
             INSERT INTO scripts
@@ -290,19 +808,20 @@ def add_script(data, db_path="smart_home.db") -> int:
             1 if data["type_of_script"] else 0
         ))
         conn.commit()
-        return c.lastrowid
+    _refresh_rules([c.lastrowid], db_path)
+    return c.lastrowid
 
 
 def list_scripts(db_path: str = "smart_home.db") -> list[sqlite3.Row]:
     """Вернуть все сценарии."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM scripts")
         return c.fetchall()
     
 def list_scripts_by_sensor(sensor_id: int, db_path: str = "smart_home.db") -> list[sqlite3.Row]:
     """Все сценарии для данного датчика."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM scripts WHERE sensor_id = ?", (sensor_id,))
         return c.fetchall()
@@ -310,19 +829,95 @@ def list_scripts_by_sensor(sensor_id: int, db_path: str = "smart_home.db") -> li
 
 def delete_script(script_id: int, db_path: str = "smart_home.db") -> None:
     """Удалить сценарий."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("DELETE FROM scripts WHERE id = ?", (script_id,))
         conn.commit()
+    _refresh_rules([script_id], db_path)
 
 def get_script_by_id(script_id: int, db_path: str = "smart_home.db") -> sqlite3.Row | None:
     """Вернуть сценарий по ID."""
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM scripts WHERE id = ?", (script_id,))
         return c.fetchone()
 def update_script(script_id: int, field: str, value, db_path="smart_home.db"):
-    with closing(get_connection(db_path)) as conn:
+    with connection(db_path) as conn:
         c = conn.cursor()
         c.execute(f"UPDATE scripts SET {field} = ? WHERE id = ?", (value, script_id))
         conn.commit()
+    _refresh_rules([script_id], db_path)
+
+# ————— Скомпилированные сценарии —————
+
+# Индекс сценариев по сенсору для каждой базы; строится при первом обращении
+# и дальше обновляется точечно при изменении сценариев и акторов
+_rule_indexes: dict[str, rules.RuleIndex] = {}
+_rules_lock = threading.Lock()
+
+_RULE_QUERY = '''
+    SELECT s.id, s.sensor_id, s.threshold, s.type_of_script,
+           s.actor_id, s.actor_value, a.channel, a.pin
+      FROM scripts s
+      JOIN actors a ON a.id = s.actor_id
+'''
+
+
+def rules_for_sensor(sensor_id: int, db_path: str = "smart_home.db") -> tuple[rules.Rule, ...]:
+    """Сценарии сенсора с уже известными каналом и пином актора."""
+    index = _rule_indexes.get(db_path)
+    if index is None:
+        with _rules_lock:
+            index = _rule_indexes.get(db_path)
+            if index is None:
+                with connection(db_path) as conn:
+                    index = _rule_indexes[db_path] = rules.RuleIndex(conn.execute(_RULE_QUERY).fetchall())
+    return index.for_sensor(sensor_id)
+
+
+def _refresh_rules(script_ids: list[int], db_path: str) -> None:
+    """Перекомпилирует сценарии script_ids; удалённые и без актора убирает."""
+    with _rules_lock:
+        index = _rule_indexes.get(db_path)
+        if index is None:
+            return
+        with connection(db_path) as conn:
+            for script_id in script_ids:
+                row = conn.execute(_RULE_QUERY + " WHERE s.id = ?", (script_id,)).fetchone()
+                if row is None:
+                    index.remove(script_id)
+                else:
+                    index.put(row)
+
+
+def _refresh_actor_rules(actor_id: int, db_path: str) -> None:
+    index = _rule_indexes.get(db_path)
+    if index is not None:
+        _refresh_rules(index.script_ids_for_actor(actor_id), db_path)
+
+
+def enable_incremental_vacuum(db_path: str = "smart_home.db") -> None:
+    """Разовое обслуживание базы, созданной до incremental auto_vacuum.
+
+    VACUUM переписывает весь файл: нужно свободное место размером с базу и
+    время (на большой базе на SD-карте — минуты), поэтому только вручную
+    и при остановленном боте. После этого compact_step возвращает место
+    от удалённых строк файловой системе.
+    """
+    flush_data(db_path)
+    with connection(db_path) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("incremental auto_vacuum уже включён")
+            return
+        print("VACUUM...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("Готово")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["vacuum"]:
+        enable_incremental_vacuum(*sys.argv[2:3])
+    else:
+        print("Использование: python database.py vacuum [путь к базе]")
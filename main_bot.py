@@ -1,17 +1,22 @@
-import telebot
+import asyncio
+from telebot.async_telebot import AsyncTeleBot
 from telebot import types
 import config
 import database
 import connect
-import threading
-import matplotlib.pyplot as plt
-from io import BytesIO
-from datetime import datetime
+import actuators
+import scheduler
+import bridge
+from bridge import db
+import charts
+import media
+import metrics
 import os
 import subprocess
 import platform
-from neyro import sozdanie
+import neyro
 import time
+import zlib
 
 def play_media_fullscreen(path: str):
     """Кросс-платформенный запуск media в максимизированном/fullscreen режиме."""
@@ -22,11 +27,15 @@ def play_media_fullscreen(path: str):
         # Linux/RPi
         subprocess.Popen(["omxplayer", "-b", "--loop", path])
 
-# Инициализация базы данных
-database.init_db()
-connect.init_ser()
-bot = telebot.TeleBot(config.BOT_TOKEN)
+# Бот, планировщик и каталог создаются в main(): модуль импортируют и процессы
+# отрисовки графиков (spawn), и бенчмарк — им не нужны база, потоки и скан медиа
+bot: AsyncTeleBot | None = None
+# Все фоновые опросы, циклы акторов и отложенные команды
+sched: scheduler.Scheduler | None = None
 user_states: dict[int, dict] = {}
+HANDLER_SECONDS = metrics.Histogram("bot_handler_seconds", "Обработка сообщения ботом, с", labels=("handler",))
+# Каталог медиафайлов с кэшем метаданных
+catalog: media.Catalog | None = None
 
 MENU_MAIN = [
     "Конфигурация оборудования",
@@ -71,40 +80,50 @@ ACTOR_PROMPTS = {
 # Поля, требующие int()
 NUMERIC_FIELDS = {'channel','pin','min_val','max_val','interval_sec','value','duration'}
 
-# Функция-заглушка отправки сигнала
-def send_signal(channel: int, pin: int, value: int) -> None:
-    """Заглушка отправки управляющего сигнала"""
-    print(connect.act(channel,pin,value))
+# Отправка управляющего сигнала
+def send_signal(channel: int, pin: int, value: int, force: bool = False) -> None:
+    """Ставит пин актора в value; повтор уже установленного значения в радиоканал не уходит"""
+    actuators.set_value(channel, pin, value, force)
+
+# Фоновые опросы сенсоров: один цикл на канал (ведомый), все его датчики — одним обменом
+# Когда каждый датчик пора опрашивать снова (по time.monotonic())
+_next_poll: dict[int, float] = {}
 
-# Фоновые опросы сенсоров
 def poll_sensor(sensor_id: int):
+    """Перезапускает цикл опроса канала, к которому подключён датчик."""
     sensor = database.get_sensor_by_id(sensor_id)
     if not sensor or sensor['interval_sec'] <= 0:
         return
 
-    # опрос датчика
-    # опрос датчика
-    # опрос и получение значения
-    value = database.get_data(sensor['channel'], sensor['pin'])
-    # сразу проверяем скрипты
-    check_scripts_for_sensor(sensor_id, value)
-    # планируем следующий опрос
-    t = threading.Timer(
-        sensor['interval_sec'],
-        lambda: threading.Thread(target=poll_sensor, args=(sensor_id,), daemon=True).start()
-    )
-    t.daemon = True
-    t.start()
+    # новый или изменённый датчик опрашиваем сразу
+    _next_poll.pop(sensor_id, None)
+    sched.call_later(0, poll_channel, sensor['channel'], key=('channel', sensor['channel']))
+
+def poll_channel(channel: int):
+    """Один цикл опроса канала. Возвращает задержку до следующего цикла."""
+    sensors = [s for s in database.list_sensors()
+               if s['channel'] == channel and s['interval_sec'] and s['interval_sec'] > 0]
+    if not sensors:
+        return None
+
+    # опрос всех датчиков канала, у которых подошёл срок
+    now = time.monotonic()
+    due = [s for s in sensors if _next_poll.get(s['id'], 0) <= now]
+    if due:
+        values = connect.sens_many([(s['channel'], s['pin']) for s in due])
+        for s, value in zip(due, values):
+            database.add_data_by_id(s['id'], value)
+            _next_poll[s['id']] = now + s['interval_sec']
+            # сразу проверяем скрипты
+            check_scripts_for_sensor(s['id'], value)
+
+    # следующий опрос — к ближайшему сроку
+    return max(0, min(_next_poll.get(s['id'], now) for s in sensors) - time.monotonic())
 
 def check_scripts_for_sensor(sensor_id: int, value: float):
-    for s in database.list_scripts_by_sensor(sensor_id):
-        value = value
-        cond = (value >= s['threshold']) if s['type_of_script'] else (value <= s['threshold'])
-        sig = s['actor_value'] if cond else 0
-        # получаем канал/пин актора
-        actor = database.get_actor_by_id(s['actor_id'])
-        if actor:
-            send_signal(actor['channel'], actor['pin'], sig)
+    # канал/пин актора уже известны из скомпилированного сценария
+    for rule in database.rules_for_sensor(sensor_id):
+        send_signal(rule.channel, rule.pin, rule.signal(value))
 
 def monitor_script(script_id: int):
     s = database.get_script_by_id(script_id)
@@ -119,146 +138,238 @@ def monitor_script(script_id: int):
         # включаем актор
         send_signal(s['channel'], s['pin'], s['actor_value'])
         # планируем выключение через duration минут
-        t_off = threading.Timer(
-            s['actor_duration'] * 60,
-            lambda: send_signal(s['channel'], s['pin'], 0)
-        )
-        t_off.daemon = True
-        t_off.start()
-    # планируем следующий «чек» через небольшую задержку (например, 5 секунд)
-    t_next = threading.Timer(
-        5,
-        lambda: monitor_script(script_id)
-    )
-    t_next.daemon = True
-    t_next.start()
+        sched.call_later(s['actor_duration'] * 60, send_signal, s['channel'], s['pin'], 0)
+    # следующий «чек» через небольшую задержку (например, 5 секунд)
+    return 5
+
 
+def start_actor(actor_id: int):
+    """Перезапускает цикл актора (вытесняет уже запланированный)."""
+    stop_actor(actor_id)
+    sched.call_later(0, poll_actor, actor_id, key=('actor', actor_id))
+
+def stop_actor(actor_id: int):
+    """Снимает цикл актора; во включённой фазе сразу выключает пин, который был включён."""
+    job = sched.cancel(('actor', actor_id))
+    if job is not None and job.fn is actor_off:
+        actor_off(*job.args, restart=False)
 
 def poll_actor(actor_id: int):
     actor = database.get_actor_by_id(actor_id)
     if not actor or actor['interval_sec'] <= 0:
-        return
+        return None
 
     # 1) включаем
     send_signal(actor['channel'], actor['pin'], actor['value'])
 
     dur = actor['duration']
-    ival = actor['interval_sec']
-
     if dur and dur > 0:
-        # функция «выключения + планирование следующего цикла»
-        def off_and_schedule():
-            send_signal(actor['channel'], actor['pin'], 0)
-            # теперь ждём interval_sec и запускаем новый цикл
-            t_next = threading.Timer(
-                ival,
-                lambda: threading.Thread(target=poll_actor, args=(actor_id,), daemon=True).start()
-            )
-            t_next.daemon = True
-            t_next.start()
-
-        t_off = threading.Timer(dur, off_and_schedule)
-        t_off.daemon = True
-        t_off.start()
+        # выключение, после него ждём interval_sec и запускаем новый цикл
+        # канал и пин запоминаем: актор могут изменить или удалить до выключения
+        sched.call_later(dur, actor_off, actor_id, actor['channel'], actor['pin'],
+                         key=('actor', actor_id))
+        return None
+    # если duration=0 — простая рутинная отправка value по интервалу
+    return actor['interval_sec']
+
+def actor_off(actor_id: int, channel: int, pin: int, restart: bool = True):
+    send_signal(channel, pin, 0)
+    if not restart:
+        return None
+    actor = database.get_actor_by_id(actor_id)
+    if actor and actor['interval_sec'] > 0:
+        sched.call_later(actor['interval_sec'], poll_actor, actor_id, key=('actor', actor_id))
+    return None
+
 
-    else:
-        # если duration=0 — простая рутинная отправка value по интервалу
-        t_cycle = threading.Timer(
-            ival,
-            lambda: threading.Thread(target=poll_actor, args=(actor_id,), daemon=True).start()
-        )
-        t_cycle.daemon = True
-        t_cycle.start()
 
 
 
+def compact_storage():
+    """Шаг очистки старых показаний: пока есть что удалять — каждую секунду, потом раз в час."""
+    return 1 if database.compact_step() else 3600
 
+def _phase(kind: str, obj_id: int, interval: float) -> float:
+    """Сдвиг первого запуска внутри интервала: по хэшу, одинаковый между перезапусками."""
+    return zlib.crc32(f"{kind}:{obj_id}".encode('utf-8')) / 2 ** 32 * interval
 
 # Запустить опросы при старте
 def start_polling_all():
+    """Регистрирует все циклы сразу; первые запуски разнесены по их интервалам,
+    чтобы не нагружать радиоканал одновременно."""
+    sched.call_later(60, compact_storage, key='retention')
+    now = time.monotonic()
+    by_channel: dict[int, list] = {}
     for s in database.list_sensors():
         if s['interval_sec'] and s['interval_sec'] > 0:
-            threading.Thread(target=poll_sensor, args=(s["id"],), daemon=True).start()
-        time.sleep(15)
+            by_channel.setdefault(s['channel'], []).append(s)
+    for channel, sensors in by_channel.items():
+        # датчики канала сдвигаем вместе, чтобы их по-прежнему опрашивал один обмен
+        delay = _phase('channel', channel, min(s['interval_sec'] for s in sensors))
+        for s in sensors:
+            _next_poll[s['id']] = now + delay
+        sched.call_later(delay, poll_channel, channel, key=('channel', channel))
     for a in database.list_actors():
         if a['interval_sec'] and a['interval_sec'] > 0:
-            threading.Thread(target=poll_actor, args=(a['id'],), daemon=True).start()
-        time.sleep(15)
+            sched.call_later(_phase('actor', a['id'], a['interval_sec']), poll_actor, a['id'],
+                             key=('actor', a['id']))
+
+async def send_chart(chat_id: int, sensor_id: int, minutes: int):
+    """Отправляет график показаний: из кэша сразу, иначе когда его нарисует пул процессов."""
+    last = await db.get_last_sensor_reading(sensor_id)
+    key = (sensor_id, minutes, charts.CHART_POINTS, last['ts'] if last else None)
+    chart = await bridge.run_db(charts.chart_async, key,
+                                lambda: database.get_sensor_data(sensor_id, minutes))
+    if chart is None:
+        await bot.send_message(chat_id, "Нет данных за указанный период.")
+        return
+    try:
+        png = await asyncio.wrap_future(chart)
+    except Exception as e:
+        print(f"Ошибка построения графика: {e}")
+        await bot.send_message(chat_id, "Не удалось построить график.")
+        return
+    await bot.send_photo(chat_id, png)
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+MEDIA_PREV = "◀ Назад"
+MEDIA_NEXT = "Вперёд ▶"
+
+async def send_media_page(chat_id: int, state: dict):
+    """Страница каталога: PAGE_SIZE кнопок с файлами и листание."""
+    files, pages = await bridge.run_blocking(catalog.page, state['page'])
+    state['page'] = max(0, min(state['page'], pages - 1))
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for info in files:
+        markup.add(types.KeyboardButton(info.name))
+    nav = []
+    if state['page'] > 0:
+        nav.append(types.KeyboardButton(MEDIA_PREV))
+    if state['page'] < pages - 1:
+        nav.append(types.KeyboardButton(MEDIA_NEXT))
+    if nav:
+        markup.row(*nav)
+    markup.add(types.KeyboardButton("Вернуться в главное меню"))
+    lines = [f"{info.name} — {info.label()}" for info in files] or ["Файлов нет."]
+    await bot.send_message(chat_id,
+        f"Выберите файл для воспроизведения (стр. {state['page'] + 1}/{pages}):\n" + "\n".join(lines),
+        reply_markup=markup)
+
+# Фоновые задачи цикла событий (ссылки держим, чтобы их не собрал сборщик мусора)
+_tasks: set[asyncio.Task] = set()
+
+def _background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def is_admin(username: str) -> bool:
+    # свежий кэш отвечает сразу; за списком из базы (до busy_timeout) идём в пул потоков
+    admin = database.cached_is_admin(f"@{username}")
+    if admin is None:
+        admin = await db.is_admin(f"@{username}")
+    return admin
+
+
+async def deliver_image(chat_id: int, job):
+    """Ждёт генерацию из очереди neyro и присылает картинку в чат."""
+    try:
+        path = await asyncio.wrap_future(job)
+    except Exception as e:
+        await bot.send_message(chat_id, f"Ошибка генерации: {e}")
+        return
+    await bot.send_photo(chat_id, await bridge.run_blocking(_read_file, path),
+                         caption=f"Изображение сохранено как {os.path.basename(path)}")
 
 # Обработчики команд и сообщений
-@bot.message_handler(commands=['start'])
-def start_handler(message):
+@HANDLER_SECONDS.time('start')
+async def start_handler(message):
     chat_id = message.chat.id
-    user_states.pop(chat_id, None)
+    state = user_states.pop(chat_id, None)
+    if state and state.get('downloaded'):
+        # брошенная загрузка — temp-файл больше не нужен
+        media.discard(state['downloaded'].path)
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     for btn in MENU_MAIN:
         markup.add(types.KeyboardButton(btn))
-    bot.send_message(chat_id, "Добро пожаловать в Smart Home Bot! Выберите действие:", reply_markup=markup)
+    await bot.send_message(chat_id, "Добро пожаловать в Smart Home Bot! Выберите действие:", reply_markup=markup)
+
+@HANDLER_SECONDS.time('stats')
+async def stats_handler(message):
+    """Сводка метрик хаба, базы, планировщика и бота — только администраторам."""
+    username = message.from_user.username
+    if not username or not await is_admin(username):
+        await bot.send_message(message.chat.id, "Команда доступна только администраторам.")
+        return
+    await bot.send_message(message.chat.id, metrics.summary())
 
-@bot.message_handler(func=lambda m: True)
-def text_handler(message):
+@HANDLER_SECONDS.time('text')
+async def text_handler(message):
     chat_id = message.chat.id
     text = message.text
 
     # проверка прав администратора
     username = message.from_user.username
-    if not username or f"@{username}" not in database.list_admins():
-        bot.send_message(chat_id,
+    if not username or not await is_admin(username):
+        await bot.send_message(chat_id,
             'Вы не являетесь администратором. Для добавления в реестр обратитесь к администратору'
         )
         return
 
     # возврат в главное меню
     if text == "Вернуться в главное меню":
-        return start_handler(message)
+        return await start_handler(message)
 
     # если в процессе диалога
     if chat_id in user_states:
-        return process_state(message)
+        return await process_state(message)
 
     # основное меню
     if text == "Конфигурация оборудования":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for btn in CONF_MENU:
             markup.add(types.KeyboardButton(btn))
-        bot.send_message(chat_id, "Выберите действие по конфигурации:", reply_markup=markup)
+        await bot.send_message(chat_id, "Выберите действие по конфигурации:", reply_markup=markup)
     
     elif text == "Редактировать устройство":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for btn in ADD_MENU:
             markup.add(types.KeyboardButton(btn))
         user_states[chat_id] = {'action': 'edit', 'type': None, 'step': 0}
-        bot.send_message(chat_id, "Что вы хотите редактировать?", reply_markup=markup)
+        await bot.send_message(chat_id, "Что вы хотите редактировать?", reply_markup=markup)
 
     elif text == "Удалить устройство":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for btn in ADD_MENU:
             markup.add(types.KeyboardButton(btn))
         user_states[chat_id] = {'action': 'delete', 'type': None, 'step': 0}
-        bot.send_message(chat_id, "Что вы хотите удалить?", reply_markup=markup)
+        await bot.send_message(chat_id, "Что вы хотите удалить?", reply_markup=markup)
 
     elif text == "Добавить устройство":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for btn in ADD_MENU:
             markup.add(types.KeyboardButton(btn))
         user_states[chat_id] = {'action': 'add', 'type': None, 'step': 0, 'data': {}}
-        bot.send_message(chat_id, "Что вы хотите добавить?", reply_markup=markup)
+        await bot.send_message(chat_id, "Что вы хотите добавить?", reply_markup=markup)
 
     elif text == "Получение показаний":
-        sensors = database.list_sensors()
+        sensors = await db.list_sensors()
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for s in sensors:
             markup.add(types.KeyboardButton(f"{s['id']}-{s['name']}"))
         user_states[chat_id] = {'action': 'get_data', 'step': 0}
-        bot.send_message(chat_id, "Выберите датчик:", reply_markup=markup)
+        await bot.send_message(chat_id, "Выберите датчик:", reply_markup=markup)
 
     elif text == "Отправка управляющего сигнала":
-        actors = database.list_actors()
+        actors = await db.list_actors()
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         for a in actors:
             markup.add(types.KeyboardButton(f"{a['id']}-{a['name']}"))
         user_states[chat_id] = {'action': 'control', 'step': 0}
-        bot.send_message(chat_id, "Выберите актор:", reply_markup=markup)
+        await bot.send_message(chat_id, "Выберите актор:", reply_markup=markup)
 
     elif text == "Сценарии":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -267,7 +378,7 @@ def text_handler(message):
         markup.add(types.KeyboardButton("Удалить сценарий"))
         markup.add(types.KeyboardButton("Вернуться в главное меню"))
         user_states[chat_id] = {'action': 'script_menu', 'step': 0, 'data': {}}
-        bot.send_message(chat_id, "Меню сценариев:", reply_markup=markup)
+        await bot.send_message(chat_id, "Меню сценариев:", reply_markup=markup)
 
 
     elif text == "Мультимедиа":
@@ -277,25 +388,25 @@ def text_handler(message):
         markup.add(types.KeyboardButton("Остановить воспроизведение"))
         markup.add(types.KeyboardButton("Вернуться в главное меню"))
         user_states[chat_id] = {'action': 'media', 'step': 0}
-        bot.send_message(chat_id, "Меню мультимедиа:", reply_markup=markup)
+        await bot.send_message(chat_id, "Меню мультимедиа:", reply_markup=markup)
 
     elif text == "Генерация изображения":
         user_states[chat_id] = {'action': 'generate_image', 'step': 0, 'data': {}}
-        bot.send_message(chat_id, "Введите текстовый запрос для генерации изображения:")
+        await bot.send_message(chat_id, "Введите текстовый запрос для генерации изображения:")
 
     elif text == "Администрация":
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add(types.KeyboardButton("Добавить администратора"))
         markup.add(types.KeyboardButton("Удалить администратора"))
         user_states[chat_id] = {'action': 'admin', 'step': 0}
-        bot.send_message(chat_id, "Меню администратора:", reply_markup=markup)
+        await bot.send_message(chat_id, "Меню администратора:", reply_markup=markup)
 
     else:
-        bot.send_message(chat_id, "Неизвестная команда. Используйте меню.")
+        await bot.send_message(chat_id, "Неизвестная команда. Используйте меню.")
 
 # Обработка состояний
 
-def process_state(message):
+async def process_state(message):
     chat_id = message.chat.id
     text = message.text
     state = user_states[chat_id]
@@ -306,7 +417,7 @@ def process_state(message):
         if state['step'] == 0:
             state['data']['prompt'] = text
             state['step'] = 1
-            bot.send_message(chat_id, "Введите имя файла для сохранения (без расширения):")
+            await bot.send_message(chat_id, "Введите имя файла для сохранения (без расширения):")
             return
 
         # step 1: получили имя файла — генерируем
@@ -314,12 +425,15 @@ def process_state(message):
             filename = text.strip()
             prompt = state['data']['prompt']
             try:
-                sozdanie(prompt, filename)
-                bot.send_message(chat_id, f"Изображение сгенерировано и сохранено как {filename}.png")
-            except Exception as e:
-                bot.send_message(chat_id, f"Ошибка генерации: {e}")
+                # submit при первом вызове импортирует requests и создаёт сессию
+                job = await bridge.run_blocking(neyro.submit, message.from_user.id, prompt, filename)
+            except neyro.QuotaExceeded as e:
+                await bot.send_message(chat_id, f"Дождитесь предыдущих генераций: {e}")
+            else:
+                await bot.send_message(chat_id, "Запрос принят, пришлю изображение, когда оно будет готово.")
+                _background(deliver_image(chat_id, job))
             user_states.pop(chat_id)
-            return start_handler(message)
+            return await start_handler(message)
 
     # — меню сценариев: выбор действия —
     if state['action'] == 'script_menu':
@@ -328,29 +442,29 @@ def process_state(message):
                 # перенаправляем в уже существующую логику создания
                 state['action'] = 'script_add'
                 state['step'] = 0
-                bot.send_message(chat_id, "Введите уникальное имя сценария:")
+                await bot.send_message(chat_id, "Введите уникальное имя сценария:")
             elif text == "Изменить сценарий":
                 state['action'] = 'script_edit'
                 state['step'] = 0
                 # список сценариев
-                scripts = database.list_scripts()
+                scripts = await db.list_scripts()
                 markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
                 for s in scripts:
                     markup.add(types.KeyboardButton(f"{s['id']}-{s['name']}"))
                 markup.add(types.KeyboardButton("Вернуться в главное меню"))
-                bot.send_message(chat_id, "Выберите сценарий для редактирования:", reply_markup=markup)
+                await bot.send_message(chat_id, "Выберите сценарий для редактирования:", reply_markup=markup)
             elif text == "Удалить сценарий":
                 state['action'] = 'script_delete'
                 state['step'] = 0
-                scripts = database.list_scripts()
+                scripts = await db.list_scripts()
                 markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
                 for s in scripts:
                     markup.add(types.KeyboardButton(f"{s['id']}-{s['name']}"))
                 markup.add(types.KeyboardButton("Вернуться в главное меню"))
-                bot.send_message(chat_id, "Выберите сценарий для удаления:", reply_markup=markup)
+                await bot.send_message(chat_id, "Выберите сценарий для удаления:", reply_markup=markup)
             else:  # Вернуться
                 user_states.pop(chat_id)
-                return start_handler(message)
+                return await start_handler(message)
             return
 
     # — создание сценария —
@@ -360,49 +474,49 @@ def process_state(message):
             state['data']['name'] = text.strip()
             state['step'] = 1
             # список датчиков
-            sensors = database.list_sensors()
+            sensors = await db.list_sensors()
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             for s in sensors:
                 markup.add(types.KeyboardButton(f"{s['id']}-{s['name']}"))
-            bot.send_message(chat_id, "Какой датчик будет триггером?", reply_markup=markup)
+            await bot.send_message(chat_id, "Какой датчик будет триггером?", reply_markup=markup)
             return
         # step 1: датчик
         if state['step'] == 1:
             state['data']['sensor_id'] = int(text.split('-')[0])
             state['step'] = 2
-            bot.send_message(chat_id, "Введите порог срабатывания (число):")
+            await bot.send_message(chat_id, "Введите порог срабатывания (число):")
             return
         # step 2: threshold
         if state['step'] == 2:
             state['data']['threshold'] = float(text)
             state['step'] = 3
             # список акторов
-            actors = database.list_actors()
+            actors = await db.list_actors()
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             for a in actors:
                 markup.add(types.KeyboardButton(f"{a['id']}-{a['name']}"))
-            bot.send_message(chat_id, "Какой актор включать?", reply_markup=markup)
+            await bot.send_message(chat_id, "Какой актор включать?", reply_markup=markup)
             return
         # step 3: актор
         if state['step'] == 3:
             state['data']['actor_id'] = int(text.split('-')[0])
             state['step'] = 4
-            bot.send_message(chat_id, "Введите мощность актора (0–255):")
+            await bot.send_message(chat_id, "Введите мощность актора (0–255):")
             return
         # step 4: actor_value
         if state['step'] == 4:
             state['data']['actor_value'] = int(text)
             state['step'] = 5
-            bot.send_message(chat_id, "Введите тип сценария (True — срабатывает при ≥threshold; False — при ≤threshold):")
+            await bot.send_message(chat_id, "Введите тип сценария (True — срабатывает при ≥threshold; False — при ≤threshold):")
             return
 
         # step 5: type_of_script
         if state['step'] == 5:
             state['data']['type_of_script'] = True if text.lower() == 'true' else False
-            script_id = database.add_script(state['data'])
-            bot.send_message(chat_id, f"Сценарий «{state['data']['name']}» создан!")
+            script_id = await db.add_script(state['data'])
+            await bot.send_message(chat_id, f"Сценарий «{state['data']['name']}» создан!")
             user_states.pop(chat_id)
-            return start_handler(message)
+            return await start_handler(message)
 
     # — редактирование сценария —
     if state['action'] == 'script_edit':
@@ -410,25 +524,25 @@ def process_state(message):
         if state['step'] == 0:
             state['script_id'] = int(text.split('-')[0])
             state['step'] = 1
-            bot.send_message(chat_id, "Введите новое пороговое значение (threshold):")
+            await bot.send_message(chat_id, "Введите новое пороговое значение (threshold):")
             return
         # шаг 1: новый threshold
         if state['step'] == 1:
             new_thr = float(text)
-            database.update_script(state['script_id'], 'threshold', new_thr)
-            bot.send_message(chat_id, "Порог сценария обновлён")
+            await db.update_script(state['script_id'], 'threshold', new_thr)
+            await bot.send_message(chat_id, "Порог сценария обновлён")
             # перезапуск мониторинга (если нужно)
             state.clear()
             user_states.pop(chat_id)
-            return start_handler(message)
+            return await start_handler(message)
     # — удаление сценария —
     if state['action'] == 'script_delete':
         # шаг 0: выбрали сценарий
         script_id = int(text.split('-')[0])
-        database.delete_script(script_id)
-        bot.send_message(chat_id, "Сценарий удалён")
+        await db.delete_script(script_id)
+        await bot.send_message(chat_id, "Сценарий удалён")
         user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
     # — добавление устройства —
     if state['action'] == 'add':
@@ -436,12 +550,12 @@ def process_state(message):
         if state['type'] is None:
             if text == "Датчик":
                 state.update({'type': 'sensor', 'fields': list(SENSOR_PROMPTS.keys()), 'step': 0, 'data': {}})
-                bot.send_message(chat_id, SENSOR_PROMPTS['name'])
+                await bot.send_message(chat_id, SENSOR_PROMPTS['name'])
             elif text == "Исполнительное":
                 state.update({'type': 'actor', 'fields': list(ACTOR_PROMPTS.keys()), 'step': 0, 'data': {}})
-                bot.send_message(chat_id, ACTOR_PROMPTS['name'])
+                await bot.send_message(chat_id, ACTOR_PROMPTS['name'])
             else:
-                bot.send_message(chat_id, "Выберите из меню.")
+                await bot.send_message(chat_id, "Выберите из меню.")
             return
 
         # ввод полей
@@ -459,21 +573,21 @@ def process_state(message):
         if state['step'] < len(state['fields']):
             next_key = state['fields'][state['step']]
             prompt = (SENSOR_PROMPTS if state['type'] == 'sensor' else ACTOR_PROMPTS)[next_key]
-            bot.send_message(chat_id, prompt)
+            await bot.send_message(chat_id, prompt)
         else:
             # сохранение
             if state['type'] == 'sensor':
-                sid = database.add_sensor(state['data'])
-                bot.send_message(chat_id, "Датчик успешно добавлен!")
-                sensor = database.get_sensor_by_id(sid)
+                sid = await db.add_sensor(state['data'])
+                await bot.send_message(chat_id, "Датчик успешно добавлен!")
+                sensor = await db.get_sensor_by_id(sid)
                 if sensor['interval_sec'] > 0:
-                    threading.Thread(target=poll_sensor, args=(sensor["id"],), daemon=True).start()
+                    poll_sensor(sensor["id"])
             else:
-                aid = database.add_actor(state['data'])
-                bot.send_message(chat_id, "Актор успешно добавлен!")
-                actor = next(a for a in database.list_actors() if a['id'] == aid)
+                aid = await db.add_actor(state['data'])
+                await bot.send_message(chat_id, "Актор успешно добавлен!")
+                actor = next(a for a in await db.list_actors() if a['id'] == aid)
                 if actor['interval_sec'] > 0:
-                    threading.Thread(target=poll_actor, args=(actor['id'],), daemon=True).start()
+                    start_actor(actor['id'])
             user_states.pop(chat_id)
         return #start_handler(message)
     
@@ -487,16 +601,11 @@ def process_state(message):
             if text == "Загрузить файл":
                 state['step'] = 1
                 state['media_action'] = 'upload'
-                bot.send_message(chat_id, "Отправьте медиафайл:")
+                await bot.send_message(chat_id, "Отправьте медиафайл:")
             elif text == "Начало воспроизведения":
                 state['step'] = 2
-                BASE_DIR = r"G:\Kodi\22052025v1Kvant\home\files"
-                files = os.listdir(BASE_DIR)
-                markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-                for fn in files:
-                    markup.add(types.KeyboardButton(fn))
-                markup.add(types.KeyboardButton("Вернуться в главное меню"))
-                bot.send_message(chat_id, "Выберите файл для воспроизведения:", reply_markup=markup)
+                state['page'] = 0
+                await send_media_page(chat_id, state)
             
             elif text == "Остановить воспроизведение":
                 if platform.system() == "Windows":
@@ -511,9 +620,9 @@ def process_state(message):
                     # глушим omxplayer, fbi, mplayer и vlc на RaspberryOS
                     for proc in ("omxplayer.bin", "fbi", "mplayer", "vlc"):
                         subprocess.Popen(["pkill", proc], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                bot.send_message(chat_id, "Воспроизведение остановлено")
+                await bot.send_message(chat_id, "Воспроизведение остановлено")
                 user_states.pop(chat_id)    
-                return start_handler(message)
+                return await start_handler(message)
             
             return
     
@@ -527,12 +636,23 @@ def process_state(message):
             print("DEBUG: media step 2, user chose file:", text)
             if text == "Вернуться в главное меню":
                 user_states.pop(chat_id)
-                return start_handler(message)
-            path = rf"G:\Kodi\22052025v1Kvant\home\files\{text}"
-            play_media_fullscreen(path)
-            bot.send_message(chat_id, "Воспроизведение запущено")
+                return await start_handler(message)
+            if text in (MEDIA_PREV, MEDIA_NEXT):
+                state['page'] += -1 if text == MEDIA_PREV else 1
+                await send_media_page(chat_id, state)
+                return
+            info = await bridge.run_blocking(catalog.probe, text)
+            if info is None:
+                await bot.send_message(chat_id, "Такого файла нет, выберите из списка.")
+                return
+            play_media_fullscreen(catalog.path(info))
+            caption = f"Воспроизведение запущено: {info.name} ({info.label()})"
+            if info.thumb:
+                await bot.send_photo(chat_id, await bridge.run_blocking(_read_file, info.thumb), caption=caption)
+            else:
+                await bot.send_message(chat_id, caption)
             user_states.pop(chat_id)
-            return start_handler(message)
+            return await start_handler(message)
     
         # шаг 3: пользователь вводит имя для последнего загруженного файла
         if state['step'] == 3:
@@ -540,30 +660,28 @@ def process_state(message):
             filename = text.strip()
             dl = state.get('downloaded')
             if not dl:
-                bot.send_message(chat_id, "Ошибка: нет загруженных данных.")
+                await bot.send_message(chat_id, "Ошибка: нет загруженных данных.")
                 user_states.pop(chat_id)
-                return start_handler(message)
+                return await start_handler(message)
     
-            BASE_DIR = r"G:\Kodi\22052025v1Kvant\home\files"
-            os.makedirs(BASE_DIR, exist_ok=True)
-            local_path = os.path.join(BASE_DIR, f"{filename}{dl['ext']}")
             try:
-                with open(local_path, 'wb') as f:
-                    f.write(dl['data'])
-                print("DEBUG: file written successfully to", local_path)
-                bot.send_message(chat_id, f"Файл сохранён: {local_path}")
+                # файл уже на диске — только атомарно переименовываем
+                local_path = await bridge.run_blocking(media.commit, dl, config.MEDIA_DIR, filename)
+                print("DEBUG: file renamed successfully to", local_path)
+                await bot.send_message(chat_id, f"Файл сохранён: {local_path}\nsha256: {dl.sha256}")
             except Exception as e:
                 print("ERROR: failed to write file:", e)
-                bot.send_message(chat_id, "Ошибка при сохранении файла.")
+                media.discard(dl.path)
+                await bot.send_message(chat_id, "Ошибка при сохранении файла.")
                 user_states.pop(chat_id)
-                return start_handler(message)
+                return await start_handler(message)
     
             # сразу воспроизводим
             play_media_fullscreen(local_path)
-            bot.send_message(chat_id, "Воспроизведение запущено")
+            await bot.send_message(chat_id, "Воспроизведение запущено")
     
             user_states.pop(chat_id)
-            return start_handler(message)
+            return await start_handler(message)
 
 
 
@@ -572,51 +690,26 @@ def process_state(message):
         if state['step'] == 0:
             state['sensor_id'] = int(text.split('-')[0])
             state['step'] = 1
-            bot.send_message(chat_id, "За сколько минут? (число)")
+            await bot.send_message(chat_id, "За сколько минут? (число)")
             return
         # построение графика
-        minutes = int(text)
-        data = database.get_sensor_data(state['sensor_id'], minutes)
-        if not data:
-            bot.send_message(chat_id, "Нет данных за указанный период.")
-        else:
-            times = [datetime.strptime(r['timestamp'], "%Y-%m-%d %H:%M:%S") for r in data]
-            vals = [r['value'] for r in data]
-            n = len(times)
-            if n > 1:
-                # 4 равных отрезка → 5 точек
-                idx = [int(i * (n-1) / 4) for i in range(5)]
-            else:
-                idx = list(range(n))
-            tcks = [times[i] for i in idx]
-            labs = [t.strftime('%H:%M') for t in tcks]
-            plt.figure()
-            plt.plot(times, vals)
-            plt.xticks(tcks, labs)
-            plt.xlabel('Время')
-            plt.ylabel('Значение')
-            plt.tight_layout()
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            plt.close()
-            bot.send_photo(chat_id, buf)
+        await send_chart(chat_id, state['sensor_id'], int(text))
         user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
     # — редактирование устройства —
     if state['action'] == 'edit':
         if state['type'] is None:
             if text == 'Датчик':
                 state['type'] = 'sensor'
-                items = database.list_sensors()
+                items = await db.list_sensors()
             else:
                 state['type'] = 'actor'
-                items = database.list_actors()
+                items = await db.list_actors()
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             for itm in items:
                 markup.add(types.KeyboardButton(f"{itm['id']}-{itm['name']}"))
-            bot.send_message(chat_id, "Выберите объект для редактирования:", reply_markup=markup)
+            await bot.send_message(chat_id, "Выберите объект для редактирования:", reply_markup=markup)
             state['step'] = 0
             return
         if state['step'] == 0:
@@ -625,7 +718,7 @@ def process_state(message):
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             for idx, f in enumerate(fields, 1):
                 markup.add(types.KeyboardButton(f"{idx}.{f}"))
-            bot.send_message(chat_id, "Введите номер параметра для изменения:", reply_markup=markup)
+            await bot.send_message(chat_id, "Введите номер параметра для изменения:", reply_markup=markup)
             state['fields'] = fields
             state['step'] = 1
             return
@@ -635,80 +728,81 @@ def process_state(message):
             state['field'] = field
             state['step'] = 2
             prompt = (SENSOR_PROMPTS if state['type'] == 'sensor' else ACTOR_PROMPTS)[field]
-            bot.send_message(chat_id, prompt)
+            await bot.send_message(chat_id, prompt)
             return
         if state['step'] == 2:
             field = state['field']
             val = int(text) if field in NUMERIC_FIELDS else text
             if state['type'] == 'sensor':
-                database.update_sensor(state['id'], state['field'], val)
+                await db.update_sensor(state['id'], state['field'], val)
                 # перезапустить фоновый опрос сенсора с новыми параметрами
-                sensor = database.get_sensor_by_id(state['id'])
+                sensor = await db.get_sensor_by_id(state['id'])
                 if sensor['interval_sec'] > 0:
-                    threading.Thread(target=poll_sensor, args=(sensor["id"],), daemon=True).start()
+                    poll_sensor(sensor["id"])
             else:
-                database.update_actor(state['id'], state['field'], val)
-                actor = next(a for a in database.list_actors() if a['id'] == state['id'])
+                await db.update_actor(state['id'], state['field'], val)
+                actor = next(a for a in await db.list_actors() if a['id'] == state['id'])
                 if actor['interval_sec'] > 0:
-                    threading.Thread(target=poll_actor, args=(actor['id'],), daemon=True).start()
-            bot.send_message(chat_id, "Параметр успешно обновлен!")
+                    start_actor(actor['id'])
+            await bot.send_message(chat_id, "Параметр успешно обновлен!")
             user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
     # — удаление устройства —
     if state['action'] == 'delete':
         if state['type'] is None:
             if text == 'Датчик':
                 state['type'] = 'sensor'
-                items = database.list_sensors()
+                items = await db.list_sensors()
             else:
                 state['type'] = 'actor'
-                items = database.list_actors()
+                items = await db.list_actors()
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             for itm in items:
                 markup.add(types.KeyboardButton(f"{itm['id']}-{itm['name']}"))
-            bot.send_message(chat_id, "Выберите объект для удаления:", reply_markup=markup)
+            await bot.send_message(chat_id, "Выберите объект для удаления:", reply_markup=markup)
             state['step'] = 0
             return
         obj_id = int(text.split('-')[0])
         if state['type'] == 'sensor':
-            database.delete_sensor(obj_id)
-            bot.send_message(chat_id, "Датчик успешно удален!")
+            await db.delete_sensor(obj_id)
+            await bot.send_message(chat_id, "Датчик успешно удален!")
         else:
-            database.delete_actor(obj_id)
-            bot.send_message(chat_id, "Актор успешно удален!")
+            stop_actor(obj_id)
+            await db.delete_actor(obj_id)
+            await bot.send_message(chat_id, "Актор успешно удален!")
         user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
     # — отправка управляющего сигнала —
     if state['action'] == 'control':
         if state['step'] == 0:
             aid = int(text.split('-')[0])
-            actor = next(a for a in database.list_actors() if a['id'] == aid)
+            actor = next(a for a in await db.list_actors() if a['id'] == aid)
             state['actor'] = actor
             state['step'] = 1
-            bot.send_message(chat_id, "Введите задержку в минутах (число):")
+            await bot.send_message(chat_id, "Введите задержку в минутах (число):")
             return
         if state['step'] == 1:
             state['delay'] = int(text)
             state['step'] = 2
-            bot.send_message(chat_id, "Введите значение сигнала (0-255):")
+            await bot.send_message(chat_id, "Введите значение сигнала (0-255):")
             return
         if state['step'] == 2:
             state['value'] = int(text)
             state['step'] = 3
-            bot.send_message(chat_id, "Введите длительность в секундах (число) или '-' для без возврата:")
+            await bot.send_message(chat_id, "Введите длительность в секундах (число) или '-' для без возврата:")
             return
         if state['step'] == 3:
             dur = 0 if text == '-' else int(text)
-            def activate():
-                send_signal(state['actor']['channel'], state['actor']['pin'], state['value'])
-            threading.Timer(state['delay'] * 60, activate).start()
+            actor = state['actor']
+            # ручная команда уходит всегда, даже если пин уже в этом состоянии
+            sched.call_later(state['delay'] * 60, send_signal, actor['channel'], actor['pin'], state['value'], True)
             if dur > 0:
-                threading.Timer(state['delay'] * 60 + dur, lambda: send_signal(state['actor']['channel'], state['actor']['pin'], 0)).start()
-            bot.send_message(chat_id, "Команда запланирована.")
+                sched.call_later(state['delay'] * 60 + dur, send_signal, actor['channel'], actor['pin'], 0, True)
+            await bot.send_message(chat_id, "Команда запланирована.")
             user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
     # — администрирование —
     if state['action'] == 'admin':
@@ -716,37 +810,37 @@ def process_state(message):
             if text == "Добавить администратора":
                 state['type'] = 'add'
                 state['step'] = 1
-                bot.send_message(chat_id, "Введите уникальный юзернейм без @:")
+                await bot.send_message(chat_id, "Введите уникальный юзернейм без @:")
                 return
             if text == "Удалить администратора":
                 state['type'] = 'del'
                 state['step'] = 1
-                admins = database.list_admins()
+                admins = await db.list_admins()
                 markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
                 for a in admins:
                     markup.add(types.KeyboardButton(a))
-                bot.send_message(chat_id, "Выберите администратора для удаления:", reply_markup=markup)
+                await bot.send_message(chat_id, "Выберите администратора для удаления:", reply_markup=markup)
                 return
             if text == "Вернуться в главное меню":
                 user_states.pop(chat_id)
-                return start_handler(message)
+                return await start_handler(message)
         if state['step'] == 1:
             if state['type'] == 'add':
                 uname = text if text.startswith('@') else f"@{text}"
-                database.add_admin_db(uname)
-                bot.send_message(chat_id, f"Администратор {uname} добавлен")
+                await db.add_admin_db(uname)
+                await bot.send_message(chat_id, f"Администратор {uname} добавлен")
             else:
-                database.delete_admin_db(text)
-                bot.send_message(chat_id, f"Администратор {text} удален")
+                await db.delete_admin_db(text)
+                await bot.send_message(chat_id, f"Администратор {text} удален")
             user_states.pop(chat_id)
-        return start_handler(message)
+        return await start_handler(message)
 
-@bot.message_handler(commands=['help'])
-def help_handler(message):
-    bot.send_message(message.chat.id, "Используйте /start для начала.")
+@HANDLER_SECONDS.time('help')
+async def help_handler(message):
+    await bot.send_message(message.chat.id, "Используйте /start для начала.")
     
-@bot.message_handler(content_types=['audio', 'video', 'document', 'photo'])
-def media_upload_handler(message):
+@HANDLER_SECONDS.time('media_upload')
+async def media_upload_handler(message):
     print("DEBUG: media_upload_handler called")
     print("DEBUG: message.content_type =", message.content_type)
     chat_id = message.chat.id
@@ -777,29 +871,70 @@ def media_upload_handler(message):
         print(f"DEBUG: determined file_id={file_id}, ext={ext}")
     except Exception as e:
         print("ERROR: failed to determine file_id/ext:", e)
-        bot.send_message(chat_id, "Ошибка при получении информации о файле.")
+        await bot.send_message(chat_id, "Ошибка при получении информации о файле.")
         return
 
-    # Получаем файл с Telegram
+    # Получаем файл с Telegram — кусками сразу во временный файл каталога медиа
     try:
-        file_info = bot.get_file(file_id)
+        file_info = await bot.get_file(file_id)
         print("DEBUG: bot.get_file returned file_path =", file_info.file_path)
-        data = bot.download_file(file_info.file_path)
-        print("DEBUG: downloaded data, length =", len(data))
+        if file_info.file_size and file_info.file_size > media.MEDIA_MAX_BYTES:
+            raise media.UploadTooLarge(f"файл больше {media.MEDIA_MAX_BYTES // (1024 * 1024)} МБ")
+        upload = await media.download(config.BOT_TOKEN, file_info.file_path, config.MEDIA_DIR, ext)
+        print("DEBUG: downloaded data, length =", upload.size, "sha256 =", upload.sha256)
+    except media.UploadTooLarge as e:
+        print("ERROR: download too large:", e)
+        await bot.send_message(chat_id, f"Файл слишком большой: {e}.")
+        return
     except Exception as e:
         print("ERROR: download failed:", e)
-        bot.send_message(chat_id, "Не удалось загрузить файл из Telegram.")
+        await bot.send_message(chat_id, "Не удалось загрузить файл из Telegram.")
         return
 
-    # Запоминаем в state и запрашиваем имя
-    state['downloaded'] = {'data': data, 'ext': ext}
+    # Запоминаем в state путь к temp-файлу и запрашиваем имя
+    if state.get('downloaded'):
+        media.discard(state['downloaded'].path)
+    state['downloaded'] = upload
     state['step'] = 3
-    bot.send_message(chat_id, "Введите имя файла (без расширения):")
+    await bot.send_message(chat_id, "Введите имя файла (без расширения):")
     print("DEBUG: waiting for filename input (step=3)")
     return
 
 
 
+def init_hub():
+    if config.HUB_SIMULATOR:
+        import simulator
+        connect.init_ser(simulator.VirtualHub())
+    else:
+        connect.init_ser(port=config.SERIAL_PORT)
+
+
+def register_handlers():
+    # порядок как у декораторов: первым подходит первый зарегистрированный
+    bot.register_message_handler(start_handler, commands=['start'])
+    bot.register_message_handler(stats_handler, commands=['stats'])
+    bot.register_message_handler(text_handler, func=lambda m: True)
+    bot.register_message_handler(help_handler, commands=['help'])
+    bot.register_message_handler(media_upload_handler,
+                                 content_types=['audio', 'video', 'document', 'photo'])
+
+
+async def main():
+    global bot, sched, catalog
+    # Инициализация базы данных
+    database.init_db()
+    bot = AsyncTeleBot(config.BOT_TOKEN)
+    sched = scheduler.Scheduler(workers=4)
+    catalog = media.Catalog(config.MEDIA_DIR)
+    register_handlers()
+    init_hub()
+    if config.METRICS_PORT:
+        metrics.serve(config.METRICS_PORT)
+    # опросы регистрируются параллельно с приёмом сообщений
+    _background(bridge.run_blocking(start_polling_all))
+    await bot.infinity_polling()
+
+
 if __name__ == '__main__':
-    start_polling_all()
-    bot.infinity_polling()
+    asyncio.run(main())
@@ -6,6 +6,7 @@
 #define CE_PIN  9
 #define CSN_PIN 10
 #define ADDR_SLAVE_COUNT 0
+#define MAX_BATCH_PINS 8   // "m255" + 8 * ",NN" укладывается в 32-байтный пакет
 
 static const uint64_t BROADCAST_ADDR = 0xABCDABCD01LL;
 static const uint64_t BASE_ADDR      = 0xF0F0F0F0E0LL;
@@ -100,6 +101,18 @@ void processHubCommand(const String &cmd) {
     int     val  = cmd.substring(second + 1).toInt();
     handleSet(id, pin, val);
   }
+  else if (type == 'm') {
+    uint8_t pins[MAX_BATCH_PINS];
+    uint8_t count = 0;
+    int comma = cmd.indexOf(',');
+    uint8_t id = cmd.substring(1, comma).toInt();
+    while (comma >= 0 && count < MAX_BATCH_PINS) {
+      int next = cmd.indexOf(',', comma + 1);
+      pins[count++] = cmd.substring(comma + 1, next < 0 ? cmd.length() : next).toInt();
+      comma = next;
+    }
+    handleMultiGet(id, pins, count);
+  }
   else {
     Serial.print("ERROR: Unknown command "); Serial.println(cmd);
   }
@@ -133,6 +146,44 @@ void handleGet(uint8_t id, uint8_t pin) {
   Serial.print("ERROR: Timeout, no response from slave "); Serial.println(id);
 }
 
+void handleMultiGet(uint8_t id, const uint8_t *pins, uint8_t count) {
+  char buf[32];
+  int len = snprintf(buf, sizeof(buf), "m%u", id);
+  for (uint8_t i = 0; i < count; i++) {
+    len += snprintf(buf + len, sizeof(buf) - len, ",%u", pins[i]);
+  }
+  uint64_t addr = BASE_ADDR | id;
+
+  radio.openWritingPipe(addr);
+  radio.openReadingPipe(1, addr);
+
+  Serial.print("DEBUG: Sending MULTI GET to slave "); Serial.print(id);
+  Serial.print(" pins "); Serial.println(count);
+
+  radio.stopListening();
+  radio.write(buf, strlen(buf) + 1);
+  radio.startListening();
+
+  unsigned long start = millis();
+  while (millis() - start < SLAVE_TIMEOUT) {
+    if (radio.available()) {
+      int results[MAX_BATCH_PINS];
+      uint8_t size = radio.getDynamicPayloadSize();
+      if (size > sizeof(results)) size = sizeof(results);
+      radio.read(results, size);
+      uint8_t got = size / sizeof(int);
+      Serial.print("DEBUG: Received values: "); Serial.println(got);
+      for (uint8_t i = 0; i < got; i++) {
+        if (i) Serial.print(',');
+        Serial.print(results[i]);
+      }
+      Serial.println();
+      return;
+    }
+  }
+  Serial.print("ERROR: Timeout, no response from slave "); Serial.println(id);
+}
+
 void handleSet(uint8_t id, uint8_t pin, int value) {
   char buf[20];
   snprintf(buf, sizeof(buf), "s%u,%u,%d", id, pin, value);
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import bridge
+
+# Ссылка на файл Telegram по токену и file_path (как в telebot)
+FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+# Больше Bot API всё равно не отдаёт
+MEDIA_MAX_BYTES = 20 * 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+# Недокачанные и неподтверждённые файлы лежат в каталоге медиа под этим префиксом
+PART_PREFIX = ".upload-"
+
+# Каталог: файлов на странице клавиатуры, полный пересмотр не реже чем раз в столько секунд,
+# куда складывать индекс и миниатюры
+PAGE_SIZE = 10
+RESCAN_SEC = 300
+CATALOG_CACHE_DIR = "home/cache/media"
+THUMB_WIDTH = 160
+
+
+class UploadTooLarge(Exception):
+    """Файл больше MEDIA_MAX_BYTES."""
+
+
+class Upload:
+    """Скачанный во временный файл медиафайл, ждущий имени."""
+
+    __slots__ = ("path", "ext", "size", "sha256")
+
+    def __init__(self, path: str, ext: str, size: int, sha256: str):
+        self.path = path
+        self.ext = ext
+        self.size = size
+        self.sha256 = sha256
+
+
+async def download(token: str, file_path: str, directory: str, ext: str,
+                   max_bytes: int = MEDIA_MAX_BYTES) -> Upload:
+    """Скачивает файл Telegram кусками прямо на диск, в temp-файл в directory.
+
+    В памяти держится не больше одного куска; по ходу считается sha256.
+    При ошибке или превышении max_bytes temp-файл удаляется.
+    """
+    import aiohttp
+    await bridge.run_blocking(os.makedirs, directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=PART_PREFIX, suffix=".part", dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(FILE_URL.format(token, file_path)) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise UploadTooLarge(f"файл больше {max_bytes // (1024 * 1024)} МБ")
+                        digest.update(chunk)
+                        await bridge.run_blocking(f.write, chunk)
+    except BaseException:
+        discard(path)
+        raise
+    return Upload(path, ext, size, digest.hexdigest())
+
+
+def commit(upload: Upload, directory: str, name: str) -> str:
+    """Атомарно переименовывает temp-файл в <name><ext> и возвращает путь."""
+    # только имя, без каталогов
+    local_path = os.path.join(directory, f"{os.path.basename(name)}{upload.ext}")
+    os.replace(upload.path, local_path)
+    return local_path
+
+
+def discard(path: str | None) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class MediaInfo:
+    """Метаданные файла каталога; duration и thumb заполняются при первом probe."""
+
+    __slots__ = ("name", "size", "mtime", "kind", "duration", "thumb", "probed")
+
+    def __init__(self, name: str, size: int, mtime: float, kind: str,
+                 duration: float | None = None, thumb: str | None = None, probed: bool = False):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.kind = kind
+        self.duration = duration
+        self.thumb = thumb
+        self.probed = probed
+
+    def label(self) -> str:
+        """Размер и длительность для списка: «12.3 МБ, 1:05»."""
+        parts = [f"{self.size / (1024 * 1024):.1f} МБ"]
+        if self.duration:
+            minutes, seconds = divmod(int(self.duration), 60)
+            parts.append(f"{minutes}:{seconds:02d}")
+        return ", ".join(parts)
+
+
+class Catalog:
+    """Индекс медиакаталога.
+
+    Список файлов пересобирается, только когда меняется mtime каталога
+    (добавление, удаление, переименование) или прошло RESCAN_SEC; у
+    неизменившихся файлов (тот же размер и mtime) метаданные сохраняются.
+    Длительность и миниатюра считаются лениво (probe) и переживают
+    перезапуск в index.json.
+    """
+
+    def __init__(self, directory: str, cache_dir: str = CATALOG_CACHE_DIR):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self._entries: dict[str, MediaInfo] = {}
+        self._names: list[str] = []
+        self._dir_mtime = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def refresh(self) -> None:
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except FileNotFoundError:
+            dir_mtime = None
+        with self._lock:
+            if dir_mtime == self._dir_mtime and time.monotonic() - self._scanned_at < RESCAN_SEC:
+                return
+            entries = {}
+            if dir_mtime is not None:
+                with os.scandir(self.directory) as it:
+                    for e in it:
+                        if e.name.startswith(PART_PREFIX) or not e.is_file():
+                            continue
+                        st = e.stat()
+                        old = self._entries.get(e.name)
+                        if old is not None and old.size == st.st_size and old.mtime == st.st_mtime:
+                            entries[e.name] = old
+                        else:
+                            entries[e.name] = MediaInfo(e.name, st.st_size, st.st_mtime, _kind(e.name))
+            changed = entries.keys() != self._entries.keys() or any(
+                entries[n] is not self._entries[n] for n in entries)
+            self._entries = entries
+            self._names = sorted(entries, key=str.lower)
+            self._dir_mtime = dir_mtime
+            self._scanned_at = time.monotonic()
+            if changed:
+                self._save()
+
+    def page(self, number: int, size: int = PAGE_SIZE) -> tuple[list[MediaInfo], int]:
+        """Файлы страницы number (с нуля) и число страниц."""
+        self.refresh()
+        with self._lock:
+            pages = max(1, -(-len(self._names) // size))
+            number = max(0, min(number, pages - 1))
+            names = self._names[number * size:(number + 1) * size]
+            return [self._entries[n] for n in names], pages
+
+    def get(self, name: str) -> MediaInfo | None:
+        self.refresh()
+        return self._entries.get(name)
+
+    def path(self, info: MediaInfo) -> str:
+        return os.path.join(self.directory, info.name)
+
+    def probe(self, name: str) -> MediaInfo | None:
+        """Метаданные файла с длительностью и миниатюрой (считаются один раз)."""
+        info = self.get(name)
+        if info is None or info.probed:
+            return info
+        path = self.path(info)
+        if info.kind in ("video", "audio"):
+            info.duration = _duration(path)
+        if info.kind in ("video", "image"):
+            info.thumb = _thumbnail(path, info, os.path.join(self.cache_dir, "thumbs"))
+        info.probed = True
+        with self._lock:
+            self._save()
+        return info
+
+    def _load(self) -> None:
+        try:
+            with open(os.path.join(self.cache_dir, "index.json"), encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._entries = {row[0]: MediaInfo(*row) for row in rows}
+
+    def _save(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, "index.json")
+        rows = [[i.name, i.size, i.mtime, i.kind, i.duration, i.thumb, i.probed]
+                for i in self._entries.values()]
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+
+def _kind(name: str) -> str:
+    mime = mimetypes.guess_type(name)[0] or ""
+    kind = mime.split("/")[0]
+    return kind if kind in ("video", "audio", "image") else "other"
+
+
+def _duration(path: str) -> float | None:
+    """Длительность через ffprobe, если он установлен."""
+    if not shutil.which("ffprobe"):
+        return None
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True, text=True, timeout=10).stdout
+        return float(out.strip())
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return None
+
+
+def _thumbnail(path: str, info: MediaInfo, thumbs_dir: str) -> str | None:
+    """JPEG-миниатюра шириной THUMB_WIDTH: картинки — через PIL, видео — кадр ffmpeg."""
+    os.makedirs(thumbs_dir, exist_ok=True)
+    key = hashlib.sha1(f"{info.name}:{info.size}:{info.mtime}".encode("utf-8")).hexdigest()
+    thumb = os.path.join(thumbs_dir, f"{key}.jpg")
+    try:
+        if info.kind == "image":
+            from PIL import Image
+            with Image.open(path) as img:
+                img.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 4))
+                img.convert("RGB").save(thumb, "JPEG")
+        elif shutil.which("ffmpeg"):
+            subprocess.run(
+                ["ffmpeg", "-v", "error", "-y", "-ss", "1", "-i", path, "-frames:v", "1",
+                 "-vf", f"scale={THUMB_WIDTH}:-1", thumb],
+                capture_output=True, timeout=20)
+    except Exception as e:
+        print(f"Не удалось сделать миниатюру {path}: {e}")
+        return None
+    return thumb if os.path.exists(thumb) else None
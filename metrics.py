@@ -0,0 +1,248 @@
+"""Счётчики и гистограммы задержек для наблюдения за хабом и ботом.
+
+Отдаются в текстовом формате Prometheus (serve) и кратким отчётом для
+команды /stats (summary). Без внешних зависимостей.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм, с: от быстрых запросов к базе до таймаута хаба
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Ограничение Telegram на длину сообщения — 4096 символов, оставляем запас
+SUMMARY_MAX_CHARS = 4000
+
+_registry: list = []
+# Дополнительные строки для /stats: fn() -> list[str]
+_summaries: list = []
+_server: ThreadingHTTPServer | None = None
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _keep(names: tuple, keep: tuple | None) -> list[int]:
+    """Индексы меток, которые остаются в /stats (keep=None — все)."""
+    return list(range(len(names))) if keep is None else [names.index(n) for n in keep]
+
+
+class Counter:
+    """Монотонный счётчик, по отдельному значению на каждый набор меток."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), summary_labels: tuple | None = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # по каким меткам разбивать /stats; остальные суммируются (None — все метки)
+        self.summary_labels = labels if summary_labels is None else summary_labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in self.samples()]
+
+    def summary(self) -> list[str]:
+        keep = _keep(self.labels, self.summary_labels)
+        merged: dict[tuple, float] = {}
+        for k, v in self.samples():
+            short = tuple(k[i] for i in keep)
+            merged[short] = merged.get(short, 0) + v
+        return [f"{self.name}{_labels(self.summary_labels, k)}: {v:g}" for k, v in sorted(merged.items())]
+
+
+class Gauge:
+    """Текущее значение, которое считается в момент чтения: fn() -> число."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.fn()}"]
+
+    def summary(self) -> list[str]:
+        return [f"{self.name}: {self.fn()}"]
+
+
+class Histogram:
+    """Распределение длительностей по корзинам buckets (секунды)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 summary_labels: tuple | None = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.summary_labels = labels if summary_labels is None else summary_labels
+        self.buckets = tuple(buckets)
+        # метки → [счётчики корзин (+Inf последней), сумма, количество]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        """Декоратор: время выполнения функции (и корутины) уходит в гистограмму."""
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, *labels)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return fn(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            return sorted((k, (list(b), s, n)) for k, (b, s, n) in self._series.items())
+
+    def quantile(self, counts: list[int], total: int, q: float) -> float:
+        """Оценка квантиля по корзинам с линейной интерполяцией внутри корзины."""
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.snapshot():
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+    def summary(self) -> list[str]:
+        keep = _keep(self.labels, self.summary_labels)
+        merged: dict[tuple, list] = {}
+        for labels, (counts, total, count) in self.snapshot():
+            short = tuple(labels[i] for i in keep)
+            series = merged.setdefault(short, [[0] * len(counts), 0.0, 0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+        lines = []
+        for labels, (counts, total, count) in sorted(merged.items()):
+            if not count:
+                continue
+            lines.append(
+                f"{self.name}{_labels(self.summary_labels, labels)}: n={count}, "
+                f"среднее {total / count * 1000:.1f} мс, "
+                f"p50 {self.quantile(counts, count, 0.5) * 1000:.1f} мс, "
+                f"p95 {self.quantile(counts, count, 0.95) * 1000:.1f} мс")
+        return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def add_summary(fn) -> None:
+    """Добавляет в /stats строки fn() -> list[str] (сводки, которых нет в самих метриках)."""
+    _summaries.append(fn)
+
+
+def summary() -> str:
+    """Краткий человекочитаемый отчёт для /stats, не длиннее SUMMARY_MAX_CHARS.
+
+    Полный разрез по всем меткам — только на /metrics.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.summary())
+    for fn in _summaries:
+        lines.extend(fn())
+    text = ""
+    for line in lines:
+        if len(text) + len(line) + 2 > SUMMARY_MAX_CHARS:
+            return text + "…"
+        text += line + "\n"
+    return text.rstrip("\n") or "Данных пока нет."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> None:
+    """Поднимает HTTP-эндпоинт /metrics в фоновом потоке (один раз)."""
+    global _server
+    if _server is not None:
+        return
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Метрики: http://{host}:{_server.server_port}/metrics")
+
+
+# Общие для процесса
+Gauge("process_threads", "Число потоков процесса", threading.active_count)
@@ -1,9 +1,14 @@
 import os
 import time
 import base64
+import hashlib
+import json
+import shutil
 import uuid
-import requests
-from PIL import Image
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import scheduler
 
 # ==============================
 #  1) ВАШИ ПАРАМЕТРЫ
@@ -28,50 +33,339 @@ OPERATIONS_URL = "https://operation.api.cloud.yandex.net/operations"
 # Папка для сохранения изображений
 OUTPUT_DIR = "home/files"
 
+# Сколько генераций идёт одновременно и сколько может быть у одного пользователя
+MAX_IN_FLIGHT = 2
+USER_QUOTA = 2
+# Опрос операции: первая пауза, множитель, потолок паузы и общий предел, с
+POLL_FIRST = 2.0
+POLL_FACTOR = 1.5
+POLL_MAX = 30.0
+JOB_TIMEOUT = 300
+# Таймауты HTTP: соединение, ответ
+HTTP_TIMEOUT = (5, 30)
+
+# Кэш готовых изображений по хэшу (модель, промт, seed, параметры) и его предельный объём.
+# В предел входят и опубликованные в OUTPUT_DIR файлы: вытесняя картинку, удаляем и их
+CACHE_DIR = "home/cache/art"
+CACHE_BYTES = 200 * 1024 * 1024
+
+
+class QuotaExceeded(Exception):
+    """У пользователя уже USER_QUOTA незавершённых генераций."""
+
+
+class _Job:
+    __slots__ = ("user_id", "name", "prompt", "seed", "key", "future", "operation_id", "delay", "deadline")
+
+    def __init__(self, user_id, name: str, prompt: str, seed: int | None):
+        self.user_id = user_id
+        self.name = name
+        self.prompt = prompt
+        self.seed = seed
+        self.key = cache_key(prompt, seed)
+        self.future = Future()
+        self.operation_id = None
+        self.delay = POLL_FIRST
+        self.deadline = 0.0
+
+
+_session: "requests.Session | None" = None
+_sched = None
+_lock = threading.Lock()
+_waiting: "deque[_Job]" = deque()
+_in_flight = 0
+_per_user: dict = {}
+
+# ключ кэша → байт на диске (файл и копии публикаций); порядок — от давно использованных к свежим
+_cache_index: "OrderedDict[str, int] | None" = None
+# ключ → опубликованные в OUTPUT_DIR файлы этой картинки: [путь, inode, байт копии]
+_published: dict[str, list[list]] = {}
+_cache_lock = threading.Lock()
+
+
+def submit(user_id, prompt: str, imya: str, seed: int = None) -> Future:
+    """Ставит генерацию в очередь и сразу возвращает Future с путём к файлу.
+
+    Одновременно выполняется не больше MAX_IN_FLIGHT генераций, остальные
+    ждут своей очереди. user_id=None — без квоты (служебные вызовы).
+    Уже генерировавшийся запрос (тот же промт и seed) отдаётся из кэша сразу.
+    """
+    job = _Job(user_id, imya, prompt, seed)
+    cached = _cached(job.key)
+    if cached is not None:
+        print(f"Изображение взято из кэша: {cached}")
+        job.future.set_result(_publish(job.key, cached, imya))
+        return job.future
+    with _lock:
+        if user_id is not None:
+            if _per_user.get(user_id, 0) >= USER_QUOTA:
+                raise QuotaExceeded(f"не больше {USER_QUOTA} генераций одновременно")
+            _per_user[user_id] = _per_user.get(user_id, 0) + 1
+        _waiting.append(job)
+    _pump()
+    return job.future
+
 
 def generate_image(imya, prompt: str, seed: int = None) -> str:
-    # создаём каталог, если нужно
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    """Синхронная генерация: ждёт готовое изображение и возвращает путь к нему."""
+    return submit(None, prompt, imya, seed).result()
 
-    # Тело POST-запроса
-    payload = {
+
+def _scheduler():
+    global _sched, _session
+    with _lock:
+        if _sched is None:
+            # requests грузим только при первой генерации: бот стартует без него
+            import requests
+            # один пул соединений на все запросы к API
+            _session = requests.Session()
+            _sched = scheduler.Scheduler(workers=MAX_IN_FLIGHT)
+        return _sched
+
+
+def _headers() -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Api-Key {API_KEY}"
+    }
+
+
+def _pump() -> None:
+    """Запускает ожидающие генерации, пока есть свободные места."""
+    global _in_flight
+    sched = _scheduler()
+    with _lock:
+        ready = []
+        while _waiting and _in_flight < MAX_IN_FLIGHT:
+            _in_flight += 1
+            ready.append(_waiting.popleft())
+    for job in ready:
+        sched.call_later(0, _start, job)
+
+
+def _options(prompt: str, seed: int | None) -> dict:
+    """Всё, от чего зависит картинка; seed=None — «любой»."""
+    return {
         "modelUri": f"art://{FOLDER_ID}/yandex-art/latest",
         # :contentReference[oaicite:10]{index=10}
+        "aspectRatio": {"widthRatio": "1", "heightRatio": "1"},
+        "seed": seed,
+        "text": prompt,
+    }
+
+
+def cache_key(prompt: str, seed: int | None = None) -> str:
+    raw = json.dumps(_options(prompt, seed), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _start(job: _Job) -> None:
+    options = _options(job.prompt, job.seed)
+    # Тело POST-запроса
+    payload = {
+        "modelUri": options["modelUri"],
         "generationOptions": {
-            "seed": seed or (uuid.uuid4().int & ((1 << 32) - 1)),
-            "aspectRatio": {"widthRatio": "1", "heightRatio": "1"}
+            "seed": job.seed or (uuid.uuid4().int & ((1 << 32) - 1)),
+            "aspectRatio": options["aspectRatio"]
         },
-        "messages": [{"weight": "1", "text": prompt}]
-    }
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {API_KEY}"
+        "messages": [{"weight": "1", "text": job.prompt}]
     }
+    try:
+        # 1) Запускаем генерацию
+        resp = _session.post(API_URL, headers=_headers(), json=payload, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        job.operation_id = resp.json()["id"]
+    except Exception as e:
+        _finish(job, error=e)
+        return
+    print(f"Операция запущена, id = {job.operation_id}")
+    job.deadline = time.monotonic() + JOB_TIMEOUT
+    _sched.call_later(job.delay, _poll, job)
 
-    # 1) Запускаем генерацию
-    resp = requests.post(API_URL, headers=headers, json=payload)
-    resp.raise_for_status()
-    operation_id = resp.json()["id"]
-    print(f"Операция запущена, id = {operation_id}")
 
-    # 2) Ожидание завершения (polling)
-    while True:
-        time.sleep(5)  # подождать 5 секунд
-        status = requests.get(f"{OPERATIONS_URL}/{operation_id}", headers=headers)
+def _poll(job: _Job):
+    """2) Один опрос операции; возвращает паузу до следующего или None."""
+    import requests
+    try:
+        status = _session.get(f"{OPERATIONS_URL}/{job.operation_id}", headers=_headers(), timeout=HTTP_TIMEOUT)
         status.raise_for_status()
         data = status.json()
-        if data.get("done"):
-            # 3) Раскодируем Base64 → байты → сохраняем
-            b64img = data["response"]["image"]
-            img_bytes = base64.b64decode(b64img)
-            filename = f"{imya}.jpeg"
-            filepath = os.path.join(OUTPUT_DIR, filename)
-            with open(filepath, "wb") as f:
-                f.write(img_bytes)
-            print(f"Изображение сохранено: {filepath}")
-            return filepath
-        else:
-            print("Ещё не готово, проверяем снова через 5 секунд...")
+    except (requests.ConnectionError, requests.Timeout) as e:
+        # сеть моргнула — попробуем на следующем опросе
+        print(f"Ошибка опроса {job.operation_id}: {e}")
+        data = {}
+    except Exception as e:
+        _finish(job, error=e)
+        return None
+
+    if data.get("done"):
+        if "error" in data:
+            _finish(job, error=RuntimeError(data["error"].get("message", data["error"])))
+            return None
+        try:
+            _finish(job, result=_save(job, data["response"]["image"]))
+        except Exception as e:
+            _finish(job, error=e)
+        return None
+    if time.monotonic() > job.deadline:
+        _finish(job, error=TimeoutError(f"генерация не завершилась за {JOB_TIMEOUT} с"))
+        return None
+    job.delay = min(job.delay * POLL_FACTOR, POLL_MAX)
+    print(f"Ещё не готово, проверяем снова через {job.delay:.0f} с...")
+    return job.delay
+
+
+def _save(job: _Job, b64img: str) -> str:
+    # 3) Раскодируем Base64 → байты → сохраняем в кэш и под именем пользователя
+    img_bytes = base64.b64decode(b64img)
+    filepath = _publish(job.key, _store(job.key, img_bytes), job.name)
+    print(f"Изображение сохранено: {filepath}")
+    return filepath
+
+
+def _publish(key: str, cache_path: str, imya: str) -> str:
+    """Кладёт картинку из кэша в OUTPUT_DIR как <imya>.jpeg — жёсткой ссылкой, без копии.
+
+    Файл запоминается в индексе и удаляется вместе с картинкой при вытеснении.
+    Если ссылку сделать нельзя (другая файловая система), копия учитывается в CACHE_BYTES.
+    """
+    with _cache_lock:
+        index = _load_index()
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        filepath = os.path.join(OUTPUT_DIR, f"{imya}.jpeg")
+        # старый файл убираем, а не перезаписываем: он может быть ссылкой на кэш
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        _forget_published(filepath)
+        try:
+            os.link(cache_path, filepath)
+            extra = 0
+        except OSError:
+            shutil.copyfile(cache_path, filepath)
+            extra = os.path.getsize(filepath)
+        if key in index:
+            _published.setdefault(key, []).append([filepath, os.stat(filepath).st_ino, extra])
+            index[key] += extra
+            index.move_to_end(key)
+        _evict()
+        _save_index()
+        return filepath
+
+
+def _forget_published(filepath: str) -> None:
+    # имя заняли заново — старая запись о нём больше не наша
+    for key, files in _published.items():
+        for entry in files:
+            if entry[0] == filepath:
+                files.remove(entry)
+                _cache_index[key] -= entry[2]
+                return
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.jpeg")
+
+
+def _ours(entry: list) -> bool:
+    """Опубликованный файл всё ещё тот, что мы положили (его не заменили и не удалили)."""
+    try:
+        return os.stat(entry[0]).st_ino == entry[1]
+    except OSError:
+        return False
+
+
+def _load_index() -> "OrderedDict[str, int]":
+    global _cache_index
+    if _cache_index is None:
+        try:
+            with open(os.path.join(CACHE_DIR, "index.json"), encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        _cache_index = OrderedDict()
+        # записи [ключ, байт на диске, [[опубликованный путь, inode, байт копии], ...]];
+        # у индексов прошлой версии третьего поля нет
+        for key, size, *rest in entries:
+            if not os.path.exists(_cache_path(key)):
+                continue
+            files = [entry for entry in (rest[0] if rest else []) if _ours(entry)]
+            _cache_index[key] = os.path.getsize(_cache_path(key)) + sum(e[2] for e in files)
+            _published[key] = files
+    return _cache_index
+
+
+def _save_index() -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, "index.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump([[key, size, _published.get(key, [])] for key, size in _cache_index.items()], f)
+    os.replace(path + ".tmp", path)
+
+
+def _evict() -> None:
+    """Вытесняет давно не использованные картинки, пока кэш с публикациями больше CACHE_BYTES."""
+    total = sum(_cache_index.values())
+    while total > CACHE_BYTES and len(_cache_index) > 1:
+        old, size = _cache_index.popitem(last=False)
+        total -= size
+        for entry in _published.pop(old, []):
+            if _ours(entry):
+                os.remove(entry[0])
+        try:
+            os.remove(_cache_path(old))
+        except FileNotFoundError:
+            pass
+
+
+def _cached(key: str) -> str | None:
+    """Путь к готовой картинке по ключу или None."""
+    with _cache_lock:
+        index = _load_index()
+        if key not in index:
+            return None
+        path = _cache_path(key)
+        if not os.path.exists(path):
+            del index[key]
+            _published.pop(key, None)
+            _save_index()
+            return None
+        # порядок LRU на диск попадёт при следующем _store: попадание не должно писать на SD-карту
+        index.move_to_end(key)
+        return path
+
+
+def _store(key: str, img_bytes: bytes) -> str:
+    """Кладёт картинку в кэш и вытесняет давно не использованные сверх CACHE_BYTES."""
+    with _cache_lock:
+        index = _load_index()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = _cache_path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(img_bytes)
+        os.replace(path + ".tmp", path)
+        index[key] = len(img_bytes) + sum(e[2] for e in _published.get(key, []))
+        index.move_to_end(key)
+        _evict()
+        _save_index()
+        return path
+
+
+def _finish(job: _Job, result=None, error: Exception | None = None) -> None:
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+        if job.user_id is not None:
+            left = _per_user.get(job.user_id, 1) - 1
+            if left > 0:
+                _per_user[job.user_id] = left
+            else:
+                _per_user.pop(job.user_id, None)
+    if error is not None:
+        print(f"Ошибка при генерации: {error}")
+        job.future.set_exception(error)
+    else:
+        job.future.set_result(result)
+    _pump()
 
 
 def sozdanie(prompt_text, nazvanie):
@@ -0,0 +1,102 @@
+import math
+import threading
+from array import array
+
+# Потолок памяти под последние показания одного сенсора: 8 байт ts + 8 байт value на показание
+RING_BYTES_PER_SENSOR = 64 * 1024
+# Столько мест выделяется сразу; дальше массивы растут удвоением до capacity
+RING_INITIAL = 64
+
+
+def capacity_for(interval_sec: float | None, window_sec: float) -> int:
+    """Сколько показаний нужно, чтобы покрыть окно window_sec при опросе раз в interval_sec.
+
+    Запас в четверть — на ручные опросы между плановыми. Без интервала
+    (датчик не опрашивается сам) — потолок: массивы всё равно растут лениво.
+    """
+    cap = RING_BYTES_PER_SENSOR // 16
+    if not interval_sec or interval_sec <= 0:
+        return cap
+    return max(RING_INITIAL, min(cap, math.ceil(window_sec / interval_sec * 1.25) + 1))
+
+
+class SensorRing:
+    """Кольцевой буфер последних показаний сенсора (ts — int64, value — double).
+
+    Показания добавляются по возрастанию ts, поэтому в буфере всегда лежит
+    непрерывный хвост истории: если самое старое показание не позже начала
+    окна, буфер отвечает за всё окно целиком. complete — в буфере вся
+    история сенсора, тогда он отвечает за любое окно.
+    """
+
+    __slots__ = ("capacity", "ts", "values", "start", "size", "complete", "lock")
+
+    def __init__(self, capacity: int = RING_BYTES_PER_SENSOR // 16):
+        self.capacity = capacity
+        allocated = min(capacity, RING_INITIAL)
+        self.ts = array('q', bytes(8 * allocated))
+        self.values = array('d', bytes(8 * allocated))
+        self.start = 0
+        self.size = 0
+        self.complete = True
+        self.lock = threading.Lock()
+
+    def append(self, ts: int, value: float) -> None:
+        with self.lock:
+            if self.size == len(self.ts) < self.capacity:
+                self._reallocate(min(self.capacity, 2 * len(self.ts)))
+            if self.size < len(self.ts):
+                i = (self.start + self.size) % len(self.ts)
+                self.size += 1
+            else:
+                i = self.start
+                self.start = (self.start + 1) % len(self.ts)
+                self.complete = False
+            self.ts[i] = ts
+            self.values[i] = value
+
+    def resize(self, capacity: int) -> None:
+        """Новый предел (интервал опроса изменился); при уменьшении остаются самые свежие."""
+        with self.lock:
+            self.capacity = capacity
+            if len(self.ts) > capacity:
+                self._reallocate(capacity)
+
+    def _reallocate(self, allocated: int) -> None:
+        # разворачиваем кольцо в начало новых массивов; не влезшие старые показания теряются
+        n = len(self.ts)
+        keep = min(self.size, allocated)
+        order = [(self.start + k) % n for k in range(self.size - keep, self.size)]
+        ts = array('q', bytes(8 * allocated))
+        values = array('d', bytes(8 * allocated))
+        for j, i in enumerate(order):
+            ts[j] = self.ts[i]
+            values[j] = self.values[i]
+        if keep < self.size:
+            self.complete = False
+        self.ts, self.values = ts, values
+        self.start, self.size = 0, keep
+
+    def last(self) -> tuple[int, float] | None:
+        with self.lock:
+            if not self.size:
+                return None
+            i = (self.start + self.size - 1) % len(self.ts)
+            return self.ts[i], self.values[i]
+
+    def since(self, cutoff: int) -> list[tuple[int, float]] | None:
+        """Показания с ts >= cutoff или None, если буфер не покрывает окно."""
+        with self.lock:
+            if not self.complete and (not self.size or self.ts[self.start] > cutoff):
+                return None
+            n = len(self.ts)
+            # бинарный поиск первого ts >= cutoff по логическим индексам кольца
+            lo, hi = 0, self.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.ts[(self.start + mid) % n] < cutoff:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return [(self.ts[(self.start + k) % n], self.values[(self.start + k) % n])
+                    for k in range(lo, self.size)]
@@ -0,0 +1,69 @@
+import threading
+
+
+class Rule:
+    """Скомпилированный сценарий: порог и уже известные канал/пин актора."""
+
+    __slots__ = ("script_id", "sensor_id", "threshold", "above", "actor_id", "actor_value", "channel", "pin")
+
+    def __init__(self, row):
+        self.script_id = row["id"]
+        self.sensor_id = row["sensor_id"]
+        self.threshold = row["threshold"]
+        self.above = bool(row["type_of_script"])  # 1: ≥threshold, 0: ≤threshold
+        self.actor_id = row["actor_id"]
+        self.actor_value = row["actor_value"]
+        self.channel = row["channel"]
+        self.pin = row["pin"]
+
+    def signal(self, value: float) -> int:
+        """Значение для актора при показании value."""
+        cond = (value >= self.threshold) if self.above else (value <= self.threshold)
+        return self.actor_value if cond else 0
+
+
+class RuleIndex:
+    """Сценарии, сгруппированные по sensor_id.
+
+    Для каждого сенсора хранится кортеж правил; при изменении он заменяется
+    целиком, поэтому читатели обходятся без блокировки.
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.Lock()
+        self._by_id: dict[int, Rule] = {}
+        self._by_sensor: dict[int, tuple[Rule, ...]] = {}
+        for row in rows:
+            rule = Rule(row)
+            self._by_id[rule.script_id] = rule
+        for rule in self._by_id.values():
+            self._by_sensor[rule.sensor_id] = self._by_sensor.get(rule.sensor_id, ()) + (rule,)
+
+    def for_sensor(self, sensor_id: int) -> tuple[Rule, ...]:
+        return self._by_sensor.get(sensor_id, ())
+
+    def put(self, row) -> None:
+        """Добавляет или заменяет правило сценария row["id"]."""
+        rule = Rule(row)
+        with self._lock:
+            old = self._by_id.get(rule.script_id)
+            self._by_id[rule.script_id] = rule
+            if old is not None and old.sensor_id != rule.sensor_id:
+                self._regroup(old.sensor_id)
+            self._regroup(rule.sensor_id)
+
+    def remove(self, script_id: int) -> None:
+        with self._lock:
+            old = self._by_id.pop(script_id, None)
+            if old is not None:
+                self._regroup(old.sensor_id)
+
+    def script_ids_for_actor(self, actor_id: int) -> list[int]:
+        return [r.script_id for r in self._by_id.values() if r.actor_id == actor_id]
+
+    def _regroup(self, sensor_id: int) -> None:
+        rules = tuple(r for r in self._by_id.values() if r.sensor_id == sensor_id)
+        if rules:
+            self._by_sensor[sensor_id] = rules
+        else:
+            self._by_sensor.pop(sensor_id, None)
@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+LAG_SECONDS = metrics.Histogram("scheduler_lag_seconds", "Опоздание запуска задачи относительно срока, с")
+
+
+class Job:
+    """Отложенный вызов в планировщике: можно отменить или перенести."""
+
+    def __init__(self, scheduler: "Scheduler", fn, args: tuple, key=None):
+        self.scheduler = scheduler
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.when = 0.0
+        self.cancelled = False
+        self._seq = 0  # номер актуальной записи в куче, старые записи пропускаются
+
+    def cancel(self) -> None:
+        self.scheduler._cancel(self)
+
+    def reschedule(self, delay: float) -> None:
+        self.scheduler._push(self, delay)
+
+
+class Scheduler:
+    """Один поток с кучей сроков и небольшой пул исполнителей.
+
+    Функция задачи может вернуть число — тогда та же задача повторится через
+    столько секунд (периодический опрос). Задача с ключом key вытесняет
+    предыдущую задачу с тем же ключом.
+    """
+
+    def __init__(self, workers: int = 4):
+        self._heap: list[tuple[float, int, Job]] = []
+        self._keys: dict = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sched")
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay: float, fn, *args, key=None) -> Job:
+        job = Job(self, fn, args, key)
+        with self._cond:
+            if key is not None:
+                old = self._keys.get(key)
+                if old is not None:
+                    old.cancelled = True
+                self._keys[key] = job
+        self._push(job, delay)
+        return job
+
+    def cancel(self, key) -> Job | None:
+        """Отменяет задачу по ключу, если она есть, и возвращает её."""
+        with self._cond:
+            job = self._keys.get(key)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _push(self, job: Job, delay: float) -> None:
+        with self._cond:
+            if job.cancelled or self._stopped:
+                return
+            job.when = time.monotonic() + max(0, delay)
+            job._seq = next(self._counter)
+            heapq.heappush(self._heap, (job.when, job._seq, job))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _cancel(self, job: Job) -> None:
+        with self._cond:
+            job.cancelled = True
+            if job.key is not None and self._keys.get(job.key) is job:
+                del self._keys[job.key]
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    # выбрасываем отменённые и перенесённые записи
+                    while self._heap and (self._heap[0][2].cancelled or self._heap[0][1] != self._heap[0][2]._seq):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+            self._pool.submit(self._run, job)
+
+    def _run(self, job: Job) -> None:
+        LAG_SECONDS.observe(max(0.0, time.monotonic() - job.when))
+        try:
+            again = job.fn(*job.args)
+        except Exception as e:
+            print(f"Ошибка в задаче {job.key or job.fn.__name__}: {e}")
+            again = None
+        if again is not None and not job.cancelled:
+            self._push(job, again)
+        elif again is None:
+            self._cancel(job)
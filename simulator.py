@@ -0,0 +1,227 @@
+import base64
+import json
+import math
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class VirtualSlave:
+    """Виртуальный ведомый: задержка радиообмена, доля потерь и значения пинов."""
+
+    def __init__(self, latency: float = 0.05, loss: float = 0.0, read=None):
+        self.latency = latency
+        self.loss = loss
+        # read(pin) -> int; по умолчанию медленная синусоида с шумом, как у analogRead
+        self.read = read
+        # что записали исполнительные команды s (pin -> value)
+        self.pins: dict[int, int] = {}
+
+
+class VirtualHub:
+    """Имитация master.ino за тем же интерфейсом, что и последовательный порт.
+
+    Команды обрабатываются строго по одной, в ответ идут те же строки, что
+    печатает мастер: DEBUG-эхо, значения, OK и «ERROR: Timeout ...».
+    slaves=None — отвечает любой канал с параметрами по умолчанию.
+    time_scale масштабирует все задержки (0 — мгновенно, для нагрузочных тестов).
+    """
+
+    SLAVE_TIMEOUT = 3.0
+
+    def __init__(self, slaves: dict[int, VirtualSlave] | None = None, latency: float = 0.05,
+                 loss: float = 0.0, time_scale: float = 1.0, timeout: float = 2, seed=None):
+        self.slaves = slaves
+        self.latency = latency
+        self.loss = loss
+        self.time_scale = time_scale
+        self.timeout = timeout
+        self._random = random.Random(seed)
+        self._default_slaves: dict[int, VirtualSlave] = {}
+        self._input: "queue.Queue[str | None]" = queue.Queue()
+        self._output: "queue.Queue[bytes]" = queue.Queue()
+        self._println("DEBUG: Master starting...")
+        self._println(f"DEBUG: Loaded slaveCount from EEPROM: {len(slaves) if slaves else 0}")
+        self._println("DEBUG: Setup complete.")
+        self._thread = threading.Thread(target=self._loop, name="virtual-hub", daemon=True)
+        self._thread.start()
+
+    # ——— интерфейс порта ———
+
+    def write(self, data: bytes) -> int:
+        for line in data.decode('utf-8').splitlines():
+            self._input.put(line)
+        return len(data)
+
+    def readline(self) -> bytes:
+        try:
+            return self._output.get(timeout=self.timeout)
+        except queue.Empty:
+            return b""
+
+    def close(self) -> None:
+        self._input.put(None)
+
+    # ——— имитация мастера ———
+
+    def slave(self, channel: int) -> VirtualSlave | None:
+        if self.slaves is not None:
+            return self.slaves.get(channel)
+        if channel not in self._default_slaves:
+            self._default_slaves[channel] = VirtualSlave(self.latency, self.loss)
+        return self._default_slaves[channel]
+
+    def _println(self, line: str) -> None:
+        self._output.put(f"{line}\r\n".encode('utf-8'))
+
+    def _sleep(self, seconds: float) -> None:
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _loop(self) -> None:
+        while True:
+            cmd = self._input.get()
+            if cmd is None:
+                return
+            cmd = cmd.strip()
+            if cmd:
+                self._println(f"DEBUG: Received hub command: {cmd}")
+                self._process(cmd)
+
+    def _process(self, cmd: str) -> None:
+        args = [_to_int(a) for a in cmd[1:].split(',')]
+        if cmd[0] == 'g' and len(args) >= 2:
+            self._handle_get(args[0], args[1])
+        elif cmd[0] == 's' and len(args) >= 3:
+            self._handle_set(args[0], args[1], args[2])
+        elif cmd[0] == 'm' and len(args) >= 2:
+            self._handle_multi_get(args[0], args[1:9])
+        else:
+            self._println(f"ERROR: Unknown command {cmd}")
+
+    def _exchange(self, channel: int) -> VirtualSlave | None:
+        """Радиообмен с ведомым: None — ответа не было за SLAVE_TIMEOUT."""
+        slave = self.slave(channel)
+        if slave is None or self._random.random() < slave.loss:
+            self._sleep(self.SLAVE_TIMEOUT)
+            return None
+        self._sleep(slave.latency)
+        return slave
+
+    def _read_pin(self, slave: VirtualSlave, channel: int, pin: int) -> int:
+        if slave.read is not None:
+            return int(slave.read(pin))
+        wave = math.sin(time.time() / 60 + channel * 7 + pin)
+        return max(0, min(1023, int(512 + 300 * wave + self._random.randint(-5, 5))))
+
+    def _handle_get(self, channel: int, pin: int) -> None:
+        self._println(f"DEBUG: Sending GET to slave {channel} pin {pin}")
+        slave = self._exchange(channel)
+        if slave is None:
+            self._println(f"ERROR: Timeout, no response from slave {channel}")
+            return
+        result = self._read_pin(slave, channel, pin)
+        self._println(f"DEBUG: Received response: {result}")
+        self._println(str(result))
+
+    def _handle_multi_get(self, channel: int, pins: list[int]) -> None:
+        self._println(f"DEBUG: Sending MULTI GET to slave {channel} pins {len(pins)}")
+        slave = self._exchange(channel)
+        if slave is None:
+            self._println(f"ERROR: Timeout, no response from slave {channel}")
+            return
+        self._println(f"DEBUG: Received values: {len(pins)}")
+        self._println(",".join(str(self._read_pin(slave, channel, p)) for p in pins))
+
+    def _handle_set(self, channel: int, pin: int, value: int) -> None:
+        self._println(f"DEBUG: Sending SET to slave {channel} pin {pin} value {value}")
+        slave = self._exchange(channel)
+        if slave is None:
+            self._println(f"ERROR: Timeout, no ACK from slave {channel}")
+            return
+        slave.pins[pin] = value
+        self._println("DEBUG: Received ACK: 6")
+        self._println("OK")
+
+
+class ArtStub:
+    """Локальная заглушка API генерации изображений для neyro.
+
+    POST {api_url} запускает операцию, GET {operations_url}/<id> отвечает
+    done=false первые polls раз, потом отдаёт image в Base64.
+    fail=True — операция завершается ошибкой.
+
+        stub = ArtStub()
+        neyro.API_URL, neyro.OPERATIONS_URL = stub.api_url, stub.operations_url
+    """
+
+    def __init__(self, polls: int = 2, image: bytes = b"\xff\xd8stub\xff\xd9", fail: bool = False):
+        self.polls = polls
+        self.image = image
+        self.fail = fail
+        self.requests: list[tuple[str, str]] = []  # (метод, путь) — для проверок
+        self._operations: dict[str, int] = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._reply(stub._start(self.path))
+
+            def do_GET(self):
+                self._reply(stub._status(self.path))
+
+            def _reply(self, answer):
+                code, body = answer
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        url = f"http://127.0.0.1:{self._server.server_port}"
+        self.api_url = f"{url}/imageGenerationAsync"
+        self.operations_url = f"{url}/operations"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="art-stub", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _start(self, path: str):
+        with self._lock:
+            self.requests.append(("POST", path))
+            operation_id = f"op{len(self._operations) + 1}"
+            self._operations[operation_id] = 0
+        return 200, {"id": operation_id, "done": False}
+
+    def _status(self, path: str):
+        operation_id = path.rsplit('/', 1)[-1]
+        with self._lock:
+            self.requests.append(("GET", path))
+            if operation_id not in self._operations:
+                return 404, {"message": "operation not found"}
+            self._operations[operation_id] += 1
+            if self._operations[operation_id] <= self.polls:
+                return 200, {"id": operation_id, "done": False}
+        if self.fail:
+            return 200, {"id": operation_id, "done": True, "error": {"message": "generation failed"}}
+        return 200, {"id": operation_id, "done": True,
+                     "response": {"image": base64.b64encode(self.image).decode('ascii')}}
+
+
+def _to_int(text: str) -> int:
+    """Как String.toInt() в Arduino: мусор даёт 0."""
+    try:
+        return int(text.strip())
+    except ValueError:
+        return 0
@@ -6,6 +6,7 @@
 #define CE_PIN   9
 #define CSN_PIN 10
 #define ADDR_ID   0
+#define MAX_BATCH_PINS 8
 
 static const uint64_t BROADCAST_ADDR = 0xABCDABCD01LL;
 static const uint64_t BASE_ADDR      = 0xF0F0F0F0E0LL;
@@ -90,6 +91,20 @@ void loop() {
     radio.startListening();
     Serial.println("DEBUG: Sent sensor result back");
   }
+  else if (cmd == 'm' && sscanf(buf+1, "%d", &id) == 1 && id == slaveId) {
+    int results[MAX_BATCH_PINS];
+    uint8_t count = 0;
+    char *tok = strchr(buf, ',');
+    while (tok && count < MAX_BATCH_PINS) {
+      results[count++] = analogRead(atoi(tok + 1));
+      tok = strchr(tok + 1, ',');
+    }
+    Serial.print("DEBUG: MULTI GET for pins: "); Serial.println(count);
+    radio.stopListening();
+    radio.write(results, count * sizeof(int));
+    radio.startListening();
+    Serial.println("DEBUG: Sent sensor results back");
+  }
   else if (cmd == 's' && sscanf(buf+1, "%d,%d,%d", &id, &pin, &val) == 3 && id == slaveId) {
     Serial.print("DEBUG: SET request pin: "); Serial.print(pin);
     Serial.print(" value: "); Serial.println(val);